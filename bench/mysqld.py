@@ -0,0 +1,100 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import mysql.connector
+
+# Throwaway MySQL/MariaDB server for benchmarks: a fresh datadir under /tmp,
+# listening on 127.0.0.1 only, root without a password, removed on stop().
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalMySQL:
+    def __init__(self, mysqld=None, database="segerahabis_bench", port=None):
+        self.mysqld = mysqld or shutil.which("mysqld") or shutil.which("mariadbd")
+        if not self.mysqld:
+            raise RuntimeError("mysqld/mariadbd not found on PATH; pass --mysqld or use --db-url")
+        self.database = database
+        self.port = port or free_port()
+        self.datadir = None
+        self._process = None
+
+    def _is_mariadb(self):
+        output = subprocess.run([self.mysqld, "--version"], capture_output=True, text=True).stdout
+        return "mariadb" in output.lower()
+
+    def _initialize(self):
+        if self._is_mariadb():
+            install_db = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+            command = [install_db, "--no-defaults", f"--datadir={self.datadir}", "--auth-root-authentication-method=normal"]
+        else:
+            command = [self.mysqld, "--no-defaults", "--initialize-insecure", f"--datadir={self.datadir}"]
+        if os.geteuid() == 0:
+            command.append("--user=root")
+        subprocess.run(command, check=True, capture_output=True)
+
+    def start(self, timeout=60):
+        self.datadir = tempfile.mkdtemp(prefix="bench-mysql-")
+        self._initialize()
+        command = [
+            self.mysqld, "--no-defaults",
+            f"--datadir={self.datadir}",
+            f"--port={self.port}",
+            "--bind-address=127.0.0.1",
+            f"--socket={os.path.join(self.datadir, 'mysqld.sock')}",
+            f"--pid-file={os.path.join(self.datadir, 'mysqld.pid')}",
+            f"--log-error={os.path.join(self.datadir, 'error.log')}",
+            "--max-connections=1000",
+            "--innodb-buffer-pool-size=256M",
+        ]
+        if not self._is_mariadb():
+            command.append("--mysqlx=OFF")
+        if os.geteuid() == 0:
+            command.append("--user=root")
+        self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = mysql.connector.connect(host="127.0.0.1", port=self.port, user="root", password="")
+                break
+            except mysql.connector.Error:
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    log = self._error_log()
+                    self.stop()
+                    raise RuntimeError(f"mysqld did not start:\n{log}")
+                time.sleep(0.25)
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{self.database}`")
+        cursor.close()
+        conn.close()
+        return self.config()
+
+    def _error_log(self, lines=20):
+        try:
+            with open(os.path.join(self.datadir, "error.log")) as log:
+                return "".join(log.readlines()[-lines:])
+        except OSError:
+            return "(no error log)"
+
+    def config(self):
+        return {"host": "127.0.0.1", "port": self.port, "user": "root", "password": "", "database": self.database}
+
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+        if self.datadir:
+            shutil.rmtree(self.datadir, ignore_errors=True)
+            self.datadir = None
@@ -0,0 +1,269 @@
+# Benchmarks the API against a throwaway database and the offline Midtrans stub.
+#   python -m bench.run                                   # local mysqld, every scenario
+#   python -m bench.run --db-url mysql://root:pw@127.0.0.1:3306/bench --scenario mix --concurrency 1,16,64
+#   python -m bench.run --json result.json --baseline previous.json
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+import httpx
+from bench import scenarios
+from bench.mysqld import LocalMySQL, free_port
+from bench.seed import create_schema, flash_sale_totals, hold_cart_locks, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_db_url(url):
+    parsed = urlparse(url)
+    return {
+        "host": parsed.hostname or "127.0.0.1",
+        "port": parsed.port or 3306,
+        "user": parsed.username or "root",
+        "password": parsed.password or "",
+        "database": parsed.path.lstrip("/") or "segerahabis_bench",
+    }
+
+
+class Server:
+    def __init__(self, app, port, env, workers=1):
+        self.app = app
+        self.port = port
+        self.env = env
+        self.workers = workers
+        self._process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, ready_path, timeout=60):
+        # Returns the seconds from spawning the server until ready_path answers
+        started = time.perf_counter()
+        command = [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1", "--port", str(self.port),
+                   "--workers", str(self.workers), "--log-level", "warning", "--no-access-log"]
+        self._process = subprocess.Popen(command, cwd=ROOT, env=self.env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"{self.app} exited with {self._process.returncode}")
+            try:
+                if httpx.get(self.url + ready_path, timeout=1).status_code < 500:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"{self.app} did not become ready")
+
+    def stop(self):
+        # SIGTERM lets the app run its lifespan shutdown (inventory flush)
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+
+
+def app_env(db_config, stub_url, args):
+    env = dict(os.environ)
+    env.update({
+        "DB_URL": db_config["host"],
+        "DB_PORT": str(db_config["port"]),
+        "DB_USER": db_config["user"],
+        "DB_PASSWORD": db_config["password"],
+        "DB_NAME": db_config["database"],
+        "SECRET_KEY": env.get("SECRET_KEY") or "bench-secret",
+        "MIDTRANS_BASE_URL": stub_url,
+        "SERVER_KEY": "stub",
+        # Sized for the mix, flash sale buyers queue for connections like real ones would
+        "DB_POOL_SIZE": env.get("DB_POOL_SIZE") or str(max(max(args.concurrency + [args.checkout_concurrency]) // args.workers, 5)),
+        # Every virtual user comes from 127.0.0.1 and runs flat out
+        "ADMISSION_ENABLED": env.get("ADMISSION_ENABLED") or "false",
+        # Lets every flash sale buyer queue for bcrypt instead of being shed
+        "BCRYPT_MAX_QUEUE": env.get("BCRYPT_MAX_QUEUE") or str(args.max_concurrency),
+    })
+    return env
+
+
+def print_report(title, report):
+    print(f"\n== {title} ({report['elapsed_s']:.1f}s, app ready after {report['startup_s']:.1f}s, "
+          f"{report['logged_in']}/{report['users']} users logged in)")
+    print(f"{'endpoint':<36} {'count':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, row in report["endpoints"].items():
+        print(f"{name:<36} {row['count']:>7} {row['errors']:>5} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+
+
+def compare(results, baseline, tolerance):
+    # A p95 that grew by more than `tolerance` against the baseline run is
+    # reported as a regression and makes the run exit non-zero.
+    regressions = []
+    for title, report in results.items():
+        previous = baseline.get(title, {}).get("endpoints", {})
+        for name, row in report.get("endpoints", {}).items():
+            before = previous.get(name)
+            if before and before["p95_ms"] > 0 and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{title} / {name}: p95 {before['p95_ms']:.1f} -> {row['p95_ms']:.1f} ms")
+    return regressions
+
+
+def run(args):
+    local = None
+    if args.db_url:
+        db_config = parse_db_url(args.db_url)
+    else:
+        local = LocalMySQL(mysqld=args.mysqld)
+        db_config = local.start()
+
+    stub = Server("external.payment_stub:app", free_port(), dict(os.environ))
+    results = {}
+    try:
+        create_schema(db_config)
+        stub.start("/snap/v2/vtweb/ready")
+        env = app_env(db_config, stub.url, args)
+
+        def with_app(scenario):
+            seeded = seed(db_config, customers=args.max_concurrency, products=args.products, flash_stock=args.flash_stock)
+            app = Server("main:app", free_port(), env, workers=args.workers)
+            # /health/ready answers once a worker has warmed up; that is the cold start
+            startup_s = app.start("/health/ready")
+            try:
+                report = asyncio.run(scenario(app.url, seeded))
+            finally:
+                app.stop()
+            report["startup_s"] = startup_s
+            return seeded, report
+
+        if "mix" in args.scenario:
+            for concurrency in args.concurrency:
+                title = f"mix c={concurrency}"
+                _, results[title] = with_app(lambda url, seeded: scenarios.run_mix(
+                    url, concurrency, args.duration, seeded["products"], args.mix))
+                print_report(title, results[title])
+
+        if "checkout" in args.scenario:
+            title = "checkout by cart size"
+            _, results[title] = with_app(lambda url, seeded: scenarios.run_checkout_sizes(
+                url, args.checkout_concurrency, args.cart_sizes, args.rounds, seeded["products"]))
+            print_report(title, results[title])
+
+        if "concurrency" in args.scenario:
+            title = "concurrency"
+
+            def lock_carts():
+                locked = threading.Event()
+                threading.Thread(target=hold_cart_locks, args=(db_config, args.hold, locked), daemon=True).start()
+                if not locked.wait(30):
+                    raise RuntimeError("could not lock the carts")
+
+            _, report = with_app(lambda url, seeded: scenarios.run_concurrency(
+                url, args.blocked, seeded["products"], lock_carts))
+            rows = report["endpoints"]
+            # Nothing that skips the locked rows may wait anywhere near the
+            # hold, and the blocked writes must finish together, not one
+            # hold after another.
+            report["concurrency_check"] = {
+                "hold_s": args.hold, "blocked": report["blocked"], "blocked_s": report["blocked_s"],
+                "live_max_ms": rows.get("GET /health/live", {}).get("max_ms"),
+                "browse_max_ms": rows.get("GET /products/{id}", {}).get("max_ms"),
+            }
+            check = report["concurrency_check"]
+            check["ok"] = (
+                check["live_max_ms"] is not None and check["live_max_ms"] < args.hold * 500
+                and check["browse_max_ms"] is not None and check["browse_max_ms"] < args.hold * 500
+                and check["blocked_s"] < args.hold * 2
+            )
+            results[title] = report
+            print_report(title, report)
+            print(f"concurrency check: {check}")
+
+        if "flash" in args.scenario:
+            title = "flash sale"
+            seeded, report = with_app(lambda url, seeded: scenarios.run_flash_sale(
+                url, args.buyers, seeded["flash_product"]))
+            # Checked after the app stopped, so leased stock has been handed back
+            sold, remaining = flash_sale_totals(db_config, seeded["flash_product"])
+            stock = seeded["flash_stock"]
+            # More buyers than stock, so every unit must sell: a buyer turned
+            # away while units were left means stock got stranded somewhere.
+            report["oversell_check"] = {
+                "stock": stock, "sold": sold, "remaining": remaining, "turned_away": report["turned_away"],
+                "oversold": sold > stock,
+                "undersold": sold < stock and report["turned_away"] > 0,
+                "lost_units": sold + remaining != stock,
+            }
+            report["oversell_check"]["ok"] = not any(
+                report["oversell_check"][key] for key in ("oversold", "undersold", "lost_units")
+            )
+            results[title] = report
+            print_report(title, report)
+            print(f"oversell check: {report['oversell_check']}")
+    finally:
+        stub.stop()
+        if local is not None:
+            local.stop()
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+    failed = False
+    for title, report in results.items():
+        if report["logged_in"] < report["users"] * args.min_participation:
+            print(f"FAIL: {title}: only {report['logged_in']} of {report['users']} users could log in")
+            failed = True
+    if "concurrency" in results and not results["concurrency"]["concurrency_check"]["ok"]:
+        print("FAIL: requests waited on unrelated blocked database calls, the event loop is being blocked")
+        failed = True
+    if "flash sale" in results and not results["flash sale"]["oversell_check"]["ok"]:
+        print("FAIL: flash sale oversold, turned buyers away with stock left, or lost units")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against a throwaway database and the Midtrans stub.")
+    parser.add_argument("--db-url", help="use this database instead of starting a local mysqld, it is wiped and reseeded")
+    parser.add_argument("--mysqld", help="mysqld/mariadbd binary, defaults to the one on PATH")
+    parser.add_argument("--scenario", default="mix,checkout,concurrency,flash", type=lambda value: value.split(","))
+    parser.add_argument("--concurrency", default="1,8,32", type=lambda value: [int(v) for v in value.split(",")],
+                        help="virtual users for the mix, one run per value")
+    parser.add_argument("--duration", default=20.0, type=float, help="seconds per mix run")
+    parser.add_argument("--mix", default=None, type=scenarios.parse_mix,
+                        help="action weights, e.g. browse=40,allproducts=25,search=10,login=5,add_to_cart=15,checkout=5")
+    parser.add_argument("--products", default=5000, type=int)
+    parser.add_argument("--cart-sizes", default="1,5,20,50", type=lambda value: [int(v) for v in value.split(",")])
+    parser.add_argument("--checkout-concurrency", default=8, type=int)
+    parser.add_argument("--rounds", default=10, type=int, help="checkouts per user and cart size")
+    parser.add_argument("--blocked", default=8, type=int, help="cart writes held up by a row lock in the concurrency check")
+    parser.add_argument("--hold", default=3.0, type=float, help="seconds the concurrency check keeps the carts locked")
+    parser.add_argument("--flash-stock", default=50, type=int)
+    parser.add_argument("--buyers", default=2000, type=int, help="flash sale buyers, far more than --flash-stock")
+    parser.add_argument("--min-participation", default=0.95, type=float,
+                        help="share of virtual users that must log in for a scenario to count")
+    parser.add_argument("--workers", default=1, type=int, help="uvicorn workers for the app")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results of an earlier run to compare p95 against")
+    parser.add_argument("--tolerance", default=0.2, type=float, help="allowed p95 growth against the baseline")
+    args = parser.parse_args()
+    args.mix = args.mix or scenarios.parse_mix(None)
+    args.max_concurrency = max(args.concurrency + [args.checkout_concurrency, args.blocked, args.buyers])
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import asyncio
+import random
+import time
+import httpx
+from bench.seed import PASSWORD, WORDS, customer_email
+
+DEFAULT_MIX = {"browse": 40, "allproducts": 25, "search": 10, "login": 5, "add_to_cart": 15, "checkout": 5}
+LOGIN_ATTEMPTS = 5
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, name, seconds, ok):
+        self.samples.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def timed(self, name, request, ok_statuses=(200,)):
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.add(name, time.perf_counter() - start, False)
+            return None
+        self.add(name, time.perf_counter() - start, response.status_code in ok_statuses)
+        return response
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def report(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        rows = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            rows[name] = {
+                "count": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "rps": len(ordered) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return {"elapsed_s": elapsed, "endpoints": rows}
+
+
+def percentile(ordered, pct):
+    # Nearest-rank percentile over an already sorted list
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"unknown action {name!r}, pick from {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class VirtualUser:
+    # One logged in customer. Keeps the ETags it has seen like a browser
+    # would, so catalog requests exercise the 304 path.
+    def __init__(self, client, recorder, index, products, rng):
+        self.client = client
+        self.recorder = recorder
+        self.index = index
+        self.products = products
+        self.rng = rng
+        self.token = None
+        self.etags = {}
+
+    @property
+    def headers(self):
+        return {"x-token": self.token} if self.token else {}
+
+    async def login(self):
+        # /login sheds with 503 and Retry-After once the bcrypt queue is full;
+        # a real client comes back, so a virtual one does too.
+        for _ in range(LOGIN_ATTEMPTS):
+            response = await self.recorder.timed("login", self.client.post(
+                "/login", json={"email": customer_email(self.index), "password": PASSWORD}
+            ))
+            if response is None or response.status_code != 503:
+                break
+            await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+        if response is not None and response.status_code == 200:
+            self.token = response.json()["access_token"]
+        return self.token is not None
+
+    async def _get_catalog(self, name, url):
+        headers = dict(self.headers)
+        if url in self.etags:
+            headers["if-none-match"] = self.etags[url]
+        response = await self.recorder.timed(name, self.client.get(url, headers=headers), ok_statuses=(200, 304))
+        if response is not None and "etag" in response.headers:
+            self.etags[url] = response.headers["etag"]
+
+    async def browse(self):
+        await self._get_catalog("GET /products/{id}", f"/products/{self.rng.randint(1, self.products)}")
+
+    async def allproducts(self):
+        after_id = self.rng.randrange(0, max(self.products - 50, 1), 50)
+        await self._get_catalog("GET /allproducts", f"/allproducts?after_id={after_id}&limit=50")
+
+    async def search(self):
+        await self.recorder.timed("GET /products/search", self.client.get(
+            "/products/search", params={"q": self.rng.choice(WORDS), "in_stock": "true"}
+        ))
+
+    async def add_to_cart(self, product_id=None, quantity=1, ok_statuses=(200,)):
+        return await self.recorder.timed("POST /cart/add", self.client.post(
+            "/cart/add",
+            data={"product_id": product_id or self.rng.randint(1, self.products - 1), "quantity": quantity},
+            headers=self.headers,
+        ), ok_statuses=ok_statuses)
+
+    async def set_cart(self, product_ids):
+        return await self.recorder.timed("POST /cart/items", self.client.post(
+            "/cart/items",
+            json=[{"product_id": product_id, "quantity": 1, "op": "set"} for product_id in product_ids],
+            headers=self.headers,
+        ))
+
+    async def checkout(self, name="POST /cart/checkout", ok_statuses=(200,)):
+        cart = await self.recorder.timed("GET /cart/", self.client.get("/cart/", headers=self.headers), ok_statuses=(200, 404))
+        if cart is None or cart.status_code != 200:
+            await self.add_to_cart()
+            cart = await self.recorder.timed("GET /cart/", self.client.get("/cart/", headers=self.headers))
+            if cart is None or cart.status_code != 200:
+                return None
+        return await self.recorder.timed(name, self.client.post(
+            "/cart/checkout", data={"cartId": cart.json()["cartId"]}, headers=self.headers
+        ), ok_statuses=ok_statuses)
+
+
+def participation(users):
+    # Users that never got a token sit the scenario out; reported so a run
+    # where most of them did cannot pass for a full one.
+    return {"users": len(users), "logged_in": sum(1 for user in users if user.token)}
+
+
+def _client(base_url, concurrency):
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=httpx.Timeout(60.0),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+
+async def run_mix(base_url, concurrency, duration, products, mix, seed=1):
+    recorder = Recorder()
+    actions, weights = zip(*mix.items())
+    deadline = time.perf_counter() + duration
+
+    async def user_loop(user):
+        if not await user.login():
+            return
+        while time.perf_counter() < deadline:
+            action = user.rng.choices(actions, weights)[0]
+            await getattr(user, action)()
+
+    async with _client(base_url, concurrency) as client:
+        users = [VirtualUser(client, recorder, i, products, random.Random(seed + i)) for i in range(concurrency)]
+        await asyncio.gather(*(user_loop(user) for user in users))
+    recorder.stop()
+    return {**recorder.report(), **participation(users)}
+
+
+async def run_concurrency(base_url, blocked, products, lock_carts, seed=1):
+    # `blocked` users add to their carts while lock_carts() keeps every cart
+    # row locked, so those requests wait in the database. /health/live and
+    # product reads must keep answering meanwhile: a handler that ran its
+    # query on the event loop would stall them until the lock is released.
+    setup = Recorder()
+    recorder = Recorder()
+    async with _client(base_url, blocked + 8) as client:
+        users = [VirtualUser(client, setup, i, products, random.Random(seed + i)) for i in range(blocked)]
+        await asyncio.gather(*(user.login() for user in users))
+        joined = participation(users)
+        users = [user for user in users if user.token]
+        # Creates the carts that get locked
+        await asyncio.gather(*(user.add_to_cart() for user in users))
+        for user in users:
+            user.recorder = recorder
+
+        await asyncio.to_thread(lock_carts)
+        done = asyncio.Event()
+
+        async def ping():
+            while not done.is_set():
+                await recorder.timed("GET /health/live", client.get("/health/live"))
+                await asyncio.sleep(0.05)
+
+        async def browse(user):
+            while not done.is_set():
+                await user.browse()
+
+        recorder.started = time.perf_counter()
+        background = [asyncio.create_task(ping()), *(asyncio.create_task(browse(user)) for user in users[:4])]
+        await asyncio.gather(*(user.add_to_cart() for user in users))
+        blocked_s = time.perf_counter() - recorder.started
+        done.set()
+        await asyncio.gather(*background)
+    recorder.stop()
+    report = recorder.report()
+    report["blocked"] = len(users)
+    report["blocked_s"] = blocked_s
+    report.update(joined)
+    return report
+
+
+async def run_checkout_sizes(base_url, concurrency, sizes, rounds, products, seed=1):
+    # Checkout latency as the cart grows; each size gets its own endpoint row.
+    recorder = Recorder()
+    async with _client(base_url, concurrency) as client:
+        users = [VirtualUser(client, recorder, i, products, random.Random(seed + i)) for i in range(concurrency)]
+        await asyncio.gather(*(user.login() for user in users))
+
+        async def user_loop(user, size):
+            for _ in range(rounds):
+                await user.set_cart(user.rng.sample(range(1, products), size))
+                await user.checkout(name=f"POST /cart/checkout [{size} items]")
+
+        for size in sizes:
+            await asyncio.gather(*(user_loop(user, size) for user in users if user.token))
+    recorder.stop()
+    return {**recorder.report(), **participation(users)}
+
+
+async def run_flash_sale(base_url, buyers, product_id, seed=1):
+    # Every buyer tries to take one unit of the same low-stock product at
+    # once. 409 is an expected answer once the stock is gone; the report
+    # counts the buyers that got one, for the oversell check.
+    recorder = Recorder()
+    turned_away = 0
+    async with _client(base_url, min(buyers, 256)) as client:
+        users = [VirtualUser(client, recorder, i, product_id, random.Random(seed + i)) for i in range(buyers)]
+        await asyncio.gather(*(user.login() for user in users))
+        start = asyncio.Event()
+
+        async def buy(user):
+            nonlocal turned_away
+            await start.wait()
+            response = await user.add_to_cart(product_id, 1, ok_statuses=(200, 409))
+            if response is not None and response.status_code == 200:
+                response = await user.checkout(name="POST /cart/checkout [flash]", ok_statuses=(200, 409))
+            if response is not None and response.status_code == 409:
+                turned_away += 1
+
+        tasks = [asyncio.create_task(buy(user)) for user in users if user.token]
+        start.set()
+        await asyncio.gather(*tasks)
+    recorder.stop()
+    report = recorder.report()
+    report["turned_away"] = turned_away
+    report.update(participation(users))
+    return report
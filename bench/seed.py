@@ -0,0 +1,102 @@
+import os
+import random
+import time
+import uuid
+import bcrypt
+import mysql.connector
+from internal.schema import migrate
+
+PASSWORD = "bench-password"
+WORDS = (
+    "kopi", "teh", "batik", "sambal", "kerupuk", "tas", "sepatu", "kemeja", "jaket", "payung",
+    "gelas", "piring", "lampu", "meja", "kursi", "buku", "pensil", "topi", "kaos", "celana",
+)
+
+
+def customer_email(index):
+    return f"bench{index}@example.com"
+
+
+def create_schema(db_config):
+    # Same migrations a real deployment runs, so the benchmark measures the
+    # keys and indexes the app actually ships with.
+    conn = mysql.connector.connect(**db_config)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+def seed(db_config, customers=200, products=5000, categories=20, stock=100000, flash_stock=50, seed=1):
+    # Every customer shares one password hash, so seeding stays fast while
+    # /login still pays the full BCRYPT_ROUNDS cost on every verify.
+    rng = random.Random(seed)
+    rounds = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    for table in (
+        "ShipmentLog", "OrderLog", "Shipment", "OrderOutbox", "CustomerOrderStats", "orderItems", "CustomerOrder",
+        "OrderNumberSequence", "ShoppingCartItem", "ShoppingCart", "CatalogVersion", "ProductCategoryMapping",
+        "ProductImageVariant", "InventoryLease", "Product", "Category", "TokenBlacklist", "Token", "Customer",
+    ):
+        cursor.execute(f"DELETE FROM {table}")
+
+    customer_ids = [str(uuid.uuid4()) for _ in range(customers)]
+    cursor.executemany(
+        "INSERT INTO Customer (uuid, userName, email, password, phone) VALUES (%s, %s, %s, %s, %s)",
+        [(cid, f"Bench User {i}", customer_email(i), hashed, f"0812{i:08d}") for i, cid in enumerate(customer_ids)]
+    )
+    cursor.executemany("INSERT INTO Category (id, name) VALUES (%s, %s)", [(i, f"category {i}") for i in range(1, categories + 1)])
+
+    rows = []
+    for i in range(1, products + 1):
+        name = " ".join(rng.sample(WORDS, 3))
+        description = " ".join(rng.choices(WORDS, k=20))
+        rows.append((i, name, description, rng.randint(5, 500) * 1000, stock, rng.randint(1, categories), rng.choice(customer_ids)))
+    # The last product is the flash sale item with a small stock
+    rows[-1] = rows[-1][:4] + (flash_stock,) + rows[-1][5:]
+    for start in range(0, len(rows), 1000):
+        cursor.executemany(
+            "INSERT INTO Product (id, name, description, price, availableItemCount, categoryId, owner_uuid) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            rows[start:start + 1000]
+        )
+    cursor.executemany(
+        "INSERT INTO ProductCategoryMapping (product_id, category_id) VALUES (%s, %s)",
+        [(row[0], row[5]) for row in rows]
+    )
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return {"customers": customers, "products": products, "flash_product": products, "flash_stock": flash_stock}
+
+
+def flash_sale_totals(db_config, product_id):
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM orderItems WHERE productId = %s", (product_id,))
+    sold = int(cursor.fetchone()[0])
+    cursor.execute("SELECT availableItemCount FROM Product WHERE id = %s", (product_id,))
+    remaining = int(cursor.fetchone()[0])
+    cursor.close()
+    conn.close()
+    return sold, remaining
+
+
+def hold_cart_locks(db_config, seconds, locked):
+    # Keeps every ShoppingCart row locked for `seconds`, so each cart write
+    # the app makes meanwhile waits in the database for the rest of it.
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.execute("SELECT cartId FROM ShoppingCart FOR UPDATE")
+        cursor.fetchall()
+        locked.set()
+        time.sleep(seconds)
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
@@ -1,30 +1,151 @@
-import os
-import midtransclient
-# from dotenv import load_dotenv
-
-# load_dotenv()
-
-def get_payment_url(order_id, gross_amount, customer_details):
-    server_key = os.getenv('SERVER_KEY')
-
-    if not server_key:
-        raise ValueError("SERVER_KEY must be set in the environment variables")
-
-    snap = midtransclient.Snap(
-        is_production=False,  # Change to False if using sandbox keys
-        server_key=server_key,
-    )
-
-    param = {
-        "transaction_details": {
-            "order_id": order_id,
-            "gross_amount": gross_amount
-        },
-        "credit_card": {
-            "secure": True
-        },
-        "customer_details": customer_details
-    }
-
-    transaction = snap.create_transaction(param)
-    return transaction['redirect_url']
\ No newline at end of file
+import asyncio
+import os
+import random
+import time
+from internal.metrics import payment_duration
+
+SANDBOX_URL = "https://app.sandbox.midtrans.com"
+PRODUCTION_URL = "https://app.midtrans.com"
+
+
+class PaymentError(Exception):
+    pass
+
+
+class CircuitOpen(PaymentError):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures; after `reset_after`
+    # seconds one trial call is let through (half-open) to probe the gateway.
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        if time.monotonic() - self.opened_at < self.reset_after or self._trial:
+            raise CircuitOpen("Payment gateway circuit is open")
+        self._trial = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+
+class MidtransClient:
+    # One long-lived client per worker: keeps HTTP connections to Snap alive
+    # between checkouts instead of building a new midtransclient.Snap per call.
+    def __init__(self, server_key, base_url=SANDBOX_URL, timeout=5.0, retries=2, backoff=0.2,
+                 breaker_threshold=5, breaker_reset=30.0):
+        self.server_key = server_key
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = None
+        self._redirects = {}
+
+    def _http(self):
+        # httpx is imported on the first payment link, not at worker start
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.server_key or "", ""),
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                headers={"Accept": "application/json"},
+            )
+        return self._client
+
+    async def create_transaction(self, param):
+        if not self.server_key:
+            raise ValueError("SERVER_KEY must be set in the environment variables")
+
+        import httpx
+        client = self._http()
+        order_id = str(param["transaction_details"]["order_id"])
+        # Retries reuse the order id as idempotency key, so a request that
+        # timed out after Midtrans accepted it does not create a second charge.
+        headers = {"Idempotency-Key": order_id}
+        last_error = None
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            start = time.perf_counter()
+            try:
+                response = await client.post("/snap/v1/transactions", json=param, headers=headers)
+            except httpx.TransportError as err:
+                payment_duration.observe(("error",), time.perf_counter() - start)
+                last_error = err
+            else:
+                payment_duration.observe((f"{response.status_code // 100}xx",), time.perf_counter() - start)
+                if response.status_code < 500 and response.status_code != 429:
+                    self.breaker.record_success()
+                    if response.status_code >= 400:
+                        raise PaymentError(f"Midtrans rejected order {order_id}: {response.text}")
+                    return response.json()
+                last_error = PaymentError(f"Midtrans answered {response.status_code}")
+            self.breaker.record_failure()
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        raise PaymentError(f"Payment gateway unavailable: {last_error}")
+
+    async def get_payment_url(self, order_id, gross_amount, customer_details):
+        if order_id in self._redirects:
+            return self._redirects[order_id]
+
+        param = {
+            "transaction_details": {
+                "order_id": order_id,
+                "gross_amount": gross_amount
+            },
+            "credit_card": {
+                "secure": True
+            },
+            "customer_details": customer_details
+        }
+
+        transaction = await self.create_transaction(param)
+        if len(self._redirects) > 10000:
+            self._redirects.clear()
+        self._redirects[order_id] = transaction['redirect_url']
+        return transaction['redirect_url']
+
+    def stats(self):
+        return {"circuit": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+def create_payment_client():
+    production = os.getenv("MIDTRANS_PRODUCTION", "false").lower() in ("1", "true", "yes")
+    return MidtransClient(
+        os.getenv('SERVER_KEY'),
+        base_url=os.getenv("MIDTRANS_BASE_URL") or (PRODUCTION_URL if production else SANDBOX_URL),
+        timeout=float(os.getenv("MIDTRANS_TIMEOUT", "5")),
+        retries=int(os.getenv("MIDTRANS_RETRIES", "2")),
+        breaker_threshold=int(os.getenv("MIDTRANS_BREAKER_THRESHOLD", "5")),
+        breaker_reset=float(os.getenv("MIDTRANS_BREAKER_RESET", "30")),
+    )
@@ -0,0 +1,39 @@
+# Local stand-in for the Midtrans Snap API, for benchmarking checkout offline.
+#   uvicorn external.payment_stub:app --port 8090
+#   MIDTRANS_BASE_URL=http://localhost:8090 SERVER_KEY=stub uvicorn main:app
+import asyncio
+import os
+import random
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+
+LATENCY_MS = float(os.getenv("MIDTRANS_STUB_LATENCY_MS", "50"))
+FAILURE_RATE = float(os.getenv("MIDTRANS_STUB_FAILURE_RATE", "0"))
+transactions = {}
+
+
+@app.post("/snap/v1/transactions")
+async def create_transaction(request: Request):
+    if LATENCY_MS:
+        await asyncio.sleep(LATENCY_MS / 1000)
+    if FAILURE_RATE and random.random() < FAILURE_RATE:
+        return JSONResponse(status_code=503, content={"error_messages": ["stub failure"]})
+
+    param = await request.json()
+    order_id = str(param["transaction_details"]["order_id"])
+    key = request.headers.get("idempotency-key") or order_id
+    if key not in transactions:
+        token = uuid.uuid4().hex
+        transactions[key] = {
+            "token": token,
+            "redirect_url": f"{request.base_url}snap/v2/vtweb/{token}",
+        }
+    return JSONResponse(status_code=201, content=transactions[key])
+
+
+@app.get("/snap/v2/vtweb/{token}")
+def payment_page(token: str):
+    return {"token": token, "status": "stub"}
@@ -0,0 +1,239 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from starlette.routing import Match
+from internal.config import env_bool
+from internal.metrics import admission_decisions
+
+# In-process admission control, applied before a request reaches its
+# handler: a token bucket per client (JWT sub, or IP without a valid token),
+# stricter buckets for chosen routes, and caps on how many requests of an
+# expensive route run at once. Clients over their rate get 429, a route at
+# its cap answers 503; both carry Retry-After. Limits are per worker, so the
+# fleet allows WEB_CONCURRENCY times as much.
+# The IP is only the client's own behind a proxy listed in
+# FORWARDED_ALLOW_IPS; otherwise every anonymous client would share the
+# proxy's bucket, so anonymous requests are only rate limited by IP once
+# that is configured. Route caps and per-user buckets always apply.
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at], least recently seen first
+        self._buckets = OrderedDict()
+
+    def take(self, key, now=None):
+        # Returns 0 when a token was taken, otherwise seconds until one is due
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimit:
+    # Only touched from the event loop, so a plain counter is enough
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self):
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+def parse_rules(text, parse_value):
+    # "/login=1:5,/allproducts=8" -> {"/login": parse_value("1:5"), ...}
+    rules = {}
+    for part in (text or "").split(","):
+        path, _, value = part.strip().partition("=")
+        if path and value:
+            rules[path.strip()] = parse_value(value.strip())
+    return rules
+
+
+def _rate(value):
+    rate, _, burst = value.partition(":")
+    return float(rate), float(burst or rate)
+
+
+class Admission:
+    def __init__(self, rate, burst, route_rates=None, route_concurrency=None, exempt=(), max_keys=100000, enabled=True,
+                 limit_by_ip=True):
+        self.enabled = enabled
+        self.limit_by_ip = limit_by_ip
+        self.limiter = RateLimiter(rate, burst, max_keys) if rate > 0 else None
+        self.route_limiters = {
+            path: RateLimiter(route_rate, route_burst, max_keys) for path, (route_rate, route_burst) in (route_rates or {}).items()
+        }
+        self.route_caps = {path: ConcurrencyLimit(limit) for path, limit in (route_concurrency or {}).items()}
+        # Plain prefixes, or route paths such as /products/{product_id}/image
+        self.exempt = tuple(path for path in exempt if "{" not in path)
+        self.exempt_routes = {path for path in exempt if "{" in path}
+        self._routes = None
+        self._exempt_routes = None
+        self._stats = {"admitted": 0, "throttled": 0, "shed": 0}
+
+    def _limited_routes(self, app):
+        # Resolved on the first request, once every route is registered
+        if self._routes is None:
+            paths = set(self.route_limiters) | set(self.route_caps)
+            self._routes = [route for route in app.routes if getattr(route, "path", None) in paths]
+        return self._routes
+
+    def match(self, scope):
+        for route in self._limited_routes(scope["app"]):
+            if route.matches(scope)[0] == Match.FULL:
+                return route
+        return None
+
+    def exempted(self, scope):
+        if scope["method"] == "OPTIONS" or scope["path"].startswith(self.exempt):
+            return True
+        if not self.exempt_routes:
+            return False
+        if self._exempt_routes is None:
+            self._exempt_routes = [
+                route for route in scope["app"].routes if getattr(route, "path", None) in self.exempt_routes
+            ]
+        return any(route.matches(scope)[0] == Match.FULL for route in self._exempt_routes)
+
+    def record(self, rule, decision):
+        self._stats[decision] += 1
+        admission_decisions.inc((rule, decision))
+
+    def stats(self):
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "limit_by_ip": self.limit_by_ip,
+            "clients_tracked": len(self.limiter) if self.limiter is not None else 0,
+            "routes": {
+                path: {
+                    "active": self.route_caps[path].active if path in self.route_caps else None,
+                    "limit": self.route_caps[path].limit if path in self.route_caps else None,
+                    "rate": self.route_limiters[path].rate if path in self.route_limiters else None,
+                    "clients_tracked": len(self.route_limiters[path]) if path in self.route_limiters else 0,
+                }
+                for path in sorted(set(self.route_limiters) | set(self.route_caps))
+            },
+        }
+
+
+def _client_key(scope, subject, by_ip):
+    # The JWT sub when the token verifies, so one account cannot dodge its
+    # limit by switching IPs and users behind one NAT do not share a bucket.
+    # None when the client is anonymous and its IP cannot be trusted.
+    for name, value in scope["headers"]:
+        if name == b"x-token":
+            sub = subject(value.decode("latin-1"))
+            if sub:
+                return f"user:{sub}"
+            break
+    if not by_ip:
+        return None
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+async def _reject(send, status, detail, retry_after):
+    body = ('{"detail":"%s"}' % detail).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(math.ceil(retry_after), 1)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    # Plain ASGI like MetricsMiddleware: a concurrency slot stays taken until
+    # a streaming response sent its last byte. `subject` maps an x-token
+    # value to its verified sub, or None.
+    def __init__(self, app, admission, subject):
+        self.app = app
+        self.admission = admission
+        self.subject = subject
+
+    async def __call__(self, scope, receive, send):
+        admission = self.admission
+        if scope["type"] != "http" or not admission.enabled or admission.exempted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        key = _client_key(scope, self.subject, admission.limit_by_ip)
+        if key is not None and admission.limiter is not None:
+            wait = admission.limiter.take(key)
+            if wait:
+                admission.record("client", "throttled")
+                await _reject(send, 429, "Too many requests, slow down", wait)
+                return
+
+        route = admission.match(scope)
+        path = route.path if route is not None else None
+        limiter = admission.route_limiters.get(path)
+        if key is not None and limiter is not None:
+            wait = limiter.take(key)
+            if wait:
+                scope["route"] = route
+                admission.record(path, "throttled")
+                await _reject(send, 429, "Too many requests, slow down", wait)
+                return
+
+        cap = admission.route_caps.get(path)
+        if cap is not None and not cap.try_acquire():
+            scope["route"] = route
+            admission.record(path, "shed")
+            await _reject(send, 503, "Server is busy, try again later", 1)
+            return
+
+        admission.record(path or "client", "admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if cap is not None:
+                cap.release()
+
+
+def create_admission():
+    return Admission(
+        rate=float(os.getenv("RATE_LIMIT_RPS", "20")),
+        burst=float(os.getenv("RATE_LIMIT_BURST", "40")),
+        route_rates=parse_rules(os.getenv("ROUTE_RATE_LIMITS", "/login=1:5,/customers/=0.2:3"), _rate),
+        route_concurrency=parse_rules(
+            os.getenv("ROUTE_CONCURRENCY", "/allproducts=8,/products/search=16,/cart/checkout=32,/products/=4"), int
+        ),
+        exempt=[
+            path.strip()
+            for path in os.getenv("ADMISSION_EXEMPT", "/health,/metrics,/products/{product_id}/image").split(",")
+            if path.strip()
+        ],
+        max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")),
+        enabled=env_bool("ADMISSION_ENABLED", True),
+        limit_by_ip=env_bool("RATE_LIMIT_BY_IP", bool(os.getenv("FORWARDED_ALLOW_IPS"))),
+    )
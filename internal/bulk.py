@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import mysql.connector
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# Row errors sent back to clients; the MySQL text only goes to the log
+ROW_CONFLICT = "row conflicts with an existing one or references a missing row"
+ROW_FAILED = "database error"
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def _row_error(err):
+    logger.warning("Bulk insert row failed: %s", err)
+    return ROW_CONFLICT if isinstance(err, mysql.connector.IntegrityError) else ROW_FAILED
+
+
+class BulkSpec:
+    def __init__(self, model, table, columns, topic=None):
+        self.model = model
+        self.columns = columns
+        # topic(record) names the live stream a new row belongs to, if any.
+        self.topic = topic
+        self.statement = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+
+    def params(self, record):
+        return tuple(getattr(record, column) for column in self.columns)
+
+
+def validate(spec, items, start_index=0):
+    # Returns (index, record) pairs ready to insert plus per-row errors.
+    records, errors = [], []
+    for offset, item in enumerate(items):
+        index = start_index + offset
+        if isinstance(item, spec.model):
+            records.append((index, item))
+            continue
+        if isinstance(item, ValueError):
+            errors.append({"index": index, "ok": False, "error": f"invalid JSON: {item}"})
+            continue
+        try:
+            if not isinstance(item, dict):
+                raise TypeError("each row must be a JSON object")
+            records.append((index, spec.model(**item)))
+        except (ValidationError, TypeError) as err:
+            errors.append({"index": index, "ok": False, "error": str(err)})
+    return records, errors
+
+
+def insert_chunk(get_connection, spec, records):
+    # The whole chunk goes in with one executemany (a multi-row INSERT) and
+    # one commit. If MySQL rejects it, the chunk is replayed row by row in a
+    # single transaction so every row gets its own result; a failing row only
+    # rolls back its own statement.
+    if not records:
+        return []
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.executemany(spec.statement, [spec.params(record) for _, record in records])
+            conn.commit()
+            return [{"index": index, "ok": True} for index, _ in records]
+        except mysql.connector.Error:
+            conn.rollback()
+
+        results = []
+        for index, record in records:
+            try:
+                cursor.execute(spec.statement, spec.params(record))
+                results.append({"index": index, "ok": True})
+            except mysql.connector.Error as err:
+                results.append({"index": index, "ok": False, "error": _row_error(err)})
+        conn.commit()
+        return results
+    except mysql.connector.Error as err:
+        conn.rollback()
+        error = _row_error(err)
+        return [{"index": index, "ok": False, "error": error} for index, _ in records]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def iter_ndjson_lines(buffer, chunk):
+    # Splits a streamed body into complete lines; returns (lines, remainder).
+    buffer += chunk
+    *lines, remainder = buffer.split(b"\n")
+    return [line for line in lines if line.strip()], remainder
+
+
+async def read_limited(stream, limit):
+    # A JSON array has to be parsed whole, so its body is capped while read
+    chunks, total = [], 0
+    async for chunk in stream:
+        total += len(chunk)
+        if total > limit:
+            raise BatchTooLarge(f"Body exceeds {limit} bytes, send NDJSON to stream larger batches")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as err:
+        return err
+
+
+def topics(spec, records, results):
+    if spec.topic is None:
+        return set()
+    ok = {result["index"] for result in results if result["ok"]}
+    return {spec.topic(record) for index, record in records if index in ok}
+
+
+def summarize(results):
+    results.sort(key=lambda result: result["index"])
+    inserted = sum(1 for result in results if result["ok"])
+    return {"inserted": inserted, "failed": len(results) - inserted, "results": results}
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    # Bounded LRU with a per-entry TTL. Concurrent misses for the same key
+    # share a single loader call instead of all hitting the database.
+    def __init__(self, maxsize=1024, ttl=60.0, enabled=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled and maxsize > 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "coalesced": 0, "invalidations": 0}
+
+    def get_or_load(self, key, loader):
+        if not self.enabled:
+            return loader()
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._data[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as exc:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(exc)
+            raise
+
+        with self._lock:
+            # An invalidate() during the load drops the in-flight marker, in
+            # which case the (possibly stale) value is returned but not stored.
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                if value is not None:
+                    self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, key):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._inflight.pop(key, None)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._inflight.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        stats["maxsize"] = self.maxsize
+        stats["ttl"] = self.ttl
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Product writes bump one counter row in CatalogVersion inside their own
+# transaction. Catalog responses are validated and cached against it, so a
+# repeat visitor gets 304 and a worker never recompresses an unchanged page.
+
+
+class CatalogVersion:
+    def __init__(self, get_connection, ttl=1.0, stock_window=60):
+        self._get_connection = get_connection
+        self.ttl = ttl
+        # Checkouts change availableItemCount without bumping the counter, so
+        # the token also rolls over every stock_window seconds; cached stock
+        # counts are never older than that.
+        self.stock_window = stock_window
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires_at = 0.0
+        self._stats = {"loads": 0, "bumps": 0}
+
+    def _load(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT version, updated_at FROM CatalogVersion WHERE id = 1")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        self._stats["loads"] += 1
+        if not row:
+            return 0, None
+        updated_at = row[1].replace(tzinfo=timezone.utc) if row[1] is not None else None
+        return row[0], updated_at
+
+    def _counter(self):
+        if self._value is not None and time.monotonic() < self._expires_at:
+            return self._value
+        with self._lock:
+            if self._value is None or time.monotonic() >= self._expires_at:
+                self._value = self._load()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._value
+
+    def current(self):
+        # Returns (token, last_modified) for the catalog as this worker sees it.
+        version, updated_at = self._counter()
+        if not self.stock_window:
+            return str(version), updated_at
+        window = int(time.time() // self.stock_window)
+        window_start = datetime.fromtimestamp(window * self.stock_window, timezone.utc)
+        last_modified = max(updated_at, window_start) if updated_at else window_start
+        return f"{version}.{window}", last_modified
+
+    def bump(self, cursor):
+        # Runs in the caller's transaction, so the new version commits (or
+        # rolls back) together with the product change.
+        cursor.execute(
+            "INSERT INTO CatalogVersion (id, version, updated_at) VALUES (1, 1, UTC_TIMESTAMP()) "
+            "ON DUPLICATE KEY UPDATE version = version + 1, updated_at = UTC_TIMESTAMP()"
+        )
+        self._stats["bumps"] += 1
+
+    def invalidate(self):
+        # Called after a bump commits so this worker picks it up at once;
+        # other workers see it within ttl seconds.
+        self._expires_at = 0.0
+
+    def stats(self):
+        stats = dict(self._stats)
+        if self._value is not None:
+            stats["version"] = self._value[0]
+            stats["updated_at"] = self._value[1].isoformat() if self._value[1] else None
+        stats["ttl"] = self.ttl
+        stats["stock_window"] = self.stock_window
+        return stats
+
+
+def create_catalog_version(get_connection):
+    return CatalogVersion(
+        get_connection,
+        ttl=float(os.getenv("CATALOG_VERSION_TTL", "1")),
+        stock_window=int(os.getenv("CATALOG_STOCK_WINDOW", "60")),
+    )
@@ -0,0 +1,249 @@
+import os
+import queue
+import threading
+import time
+import mysql.connector
+from internal.config import env_bool
+from internal.metrics import METRICS_ENABLED, observe_query
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TimedCursor:
+    # Times execute/executemany per statement fingerprint; everything else
+    # (fetch*, rowcount, lastrowid) goes straight to the real cursor.
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._raw.execute(operation, params, *args, **kwargs)
+        finally:
+            observe_query(operation, time.perf_counter() - start)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._raw.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            observe_query(operation, time.perf_counter() - start)
+
+
+class PooledConnection:
+    # Thin proxy so handlers keep calling conn.close(); closing hands the
+    # connection back to the pool instead of tearing down the socket.
+    def __init__(self, pool, raw, created_at, statements):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._statements = statements
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._raw.cursor(*args, **kwargs)
+        return TimedCursor(cursor) if METRICS_ENABLED else cursor
+
+    def prepared(self, statement, dictionary=False):
+        # Server-side prepared statement, kept open for as long as the
+        # physical connection lives, so later checkouts skip the PREPARE.
+        # mysql.connector only reuses it when `statement` is the same str
+        # object, so callers pass module-level constants. Always read the
+        # whole result and never close the returned cursor.
+        if not self._pool.prepare:
+            return self.cursor(dictionary=dictionary)
+        key = (statement, dictionary)
+        cursor = self._statements.get(key)
+        if cursor is None:
+            cursor = self.cursor(prepared=True, dictionary=dictionary)
+            self._statements[key] = cursor
+            self._pool._count("statements_prepared")
+        return cursor
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool._release(self._raw, self._created_at, self._statements)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, config, size=5, max_overflow=10, timeout=30.0, recycle=3600, pre_ping=True, prepare=True):
+        self._config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.prepare = prepare
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._stats = {
+            "connections_opened": 0,
+            "connections_recycled": 0,
+            "connections_discarded": 0,
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "statements_prepared": 0,
+        }
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self._config)
+        with self._lock:
+            self._stats["connections_opened"] += 1
+        return raw, time.monotonic(), {}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _discard(self, raw, key="connections_discarded"):
+        try:
+            raw.close()
+        except mysql.connector.Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats[key] += 1
+
+    def _is_usable(self, raw, created_at):
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            self._discard(raw, "connections_recycled")
+            return False
+        if self.pre_ping:
+            try:
+                raw.ping(reconnect=False)
+            except mysql.connector.Error:
+                self._discard(raw)
+                return False
+        return True
+
+    def connection(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            try:
+                raw, created_at, statements = self._idle.get_nowait()
+            except queue.Empty:
+                raw = None
+                with self._lock:
+                    can_open = self._open < self.size + self.max_overflow
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        raw, created_at, statements = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._lock:
+                            self._stats["checkout_timeouts"] += 1
+                        raise PoolTimeout("Timed out waiting for a database connection")
+                    try:
+                        raw, created_at, statements = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                if not self._is_usable(raw, created_at):
+                    continue
+            else:
+                if not self._is_usable(raw, created_at):
+                    continue
+
+            waited = time.monotonic() - start
+            with self._lock:
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                self._stats["wait_seconds_total"] += waited
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+            return PooledConnection(self, raw, created_at, statements)
+
+    def _release(self, raw, created_at, statements):
+        with self._lock:
+            self._in_use -= 1
+            overflowing = self._idle.qsize() >= self.size
+        if overflowing:
+            self._discard(raw)
+            return
+        try:
+            # Drop any half-read result or open transaction a handler left
+            # behind before the connection is reused.
+            if raw.unread_result:
+                raw.consume_results()
+            if raw.in_transaction:
+                raw.rollback()
+        except mysql.connector.Error:
+            self._discard(raw)
+            return
+        self._idle.put((raw, created_at, statements))
+
+    def warm(self, count=None):
+        # Opens up to `count` connections before traffic arrives, so the first
+        # requests of a fresh worker do not each pay the connect handshake.
+        count = self.size if count is None else min(count, self.size)
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(self.connection())
+        finally:
+            for conn in conns:
+                conn.close()
+        return len(conns)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+            stats["in_use"] = self._in_use
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        stats["max_overflow"] = self.max_overflow
+        checkouts = stats["checkouts"]
+        stats["wait_seconds_avg"] = stats["wait_seconds_total"] / checkouts if checkouts else 0.0
+        return stats
+
+
+def config_from_env():
+    return {
+        "host": os.getenv("DB_URL"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+        "port": os.getenv("DB_PORT")
+    }
+
+
+def create_pool(db_config):
+    return ConnectionPool(
+        db_config,
+        size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        recycle=int(os.getenv("DB_POOL_RECYCLE", "3600")),
+        pre_ping=env_bool("DB_POOL_PRE_PING", True),
+        prepare=env_bool("DB_PREPARED_STATEMENTS", True),
+    )
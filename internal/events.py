@@ -0,0 +1,47 @@
+import asyncio
+
+
+class LogNotifier:
+    # Wakes live status streams when a log row they follow is written by this
+    # worker. Rows written by other workers are still picked up by the
+    # stream's periodic re-check, so this only shortens the delay.
+    def __init__(self):
+        self._waiters = {}
+        self._loop = None
+
+    async def wait(self, keys, timeout):
+        self._loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        for key in keys:
+            self._waiters.setdefault(key, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            for key in keys:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(event)
+                    if not waiters:
+                        del self._waiters[key]
+
+    def _wake(self, keys):
+        for key in keys:
+            for event in self._waiters.get(key, ()):
+                event.set()
+
+    def publish(self, keys):
+        # Safe to call from the event loop or from an executor thread.
+        loop = self._loop
+        if loop is None or not keys:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake(keys)
+        else:
+            loop.call_soon_threadsafe(self._wake, list(keys))
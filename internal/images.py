@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from starlette.routing import Match
+
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def detect_image_type(data):
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    # Only single byte ranges are served; anything else falls back to the
+    # full body, which RFC 9110 allows.
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if end and last < first:
+        # Not a valid range at all, so it is ignored rather than refused
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    return first, min(last, size - 1)
+
+
+# Fixed variants rendered at upload time; listing pages use "small".
+VARIANTS = {
+    "thumb": 160,
+    "small": 480,
+}
+VARIANT_TYPE = "image/webp"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def max_image_bytes():
+    return int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+
+
+def max_image_pixels():
+    # Pillow's own default (~89 MP) lets a small, highly compressed file
+    # decode into gigabytes; 4096 x 4096 is plenty for a product photo.
+    return int(os.getenv("MAX_IMAGE_PIXELS", str(4096 * 4096)))
+
+
+# Room for the other form fields and multipart framing next to the image
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+
+async def _too_large(send, limit):
+    body = json.dumps({"detail": f"Upload exceeds {limit} bytes"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class UploadLimitMiddleware:
+    # Starlette spools the whole multipart body before a handler (and so
+    # read_upload) runs. This refuses a body over the limit on the upload
+    # routes up front by Content-Length, and stops reading a chunked one as
+    # soon as it passes the limit.
+    def __init__(self, app, paths, limit=None):
+        self.app = app
+        self.paths = set(paths)
+        self.limit = limit or max_image_bytes() + UPLOAD_FORM_OVERHEAD
+        self._routes = None
+
+    def _matches(self, scope):
+        if self._routes is None:
+            self._routes = [route for route in scope["app"].routes if getattr(route, "path", None) in self.paths]
+        return any(route.matches(scope)[0] == Match.FULL for route in self._routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH") or not self._matches(scope):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.limit:
+                    await _too_large(send, self.limit)
+                    return
+                break
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    rejected = True
+                    await _too_large(send, self.limit)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app answers to the cut-off body is dropped
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+
+async def read_upload(upload, limit=None):
+    limit = limit or max_image_bytes()
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise ImageTooLarge(f"Image exceeds {limit} bytes")
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    if detect_image_type(data) is None:
+        raise UnsupportedImage("Image must be JPEG, PNG, GIF or WebP")
+    return data
+
+
+def _render_variants(data):
+    # Runs in a worker process; Pillow is only needed there.
+    from PIL import Image, UnidentifiedImageError
+
+    limit = max_image_pixels()
+    Image.MAX_IMAGE_PIXELS = limit
+    try:
+        source = Image.open(io.BytesIO(data))
+        # Only the header has been read so far. Pillow merely warns between
+        # its limit and twice that, so the size is checked here as well.
+        if source.width * source.height > limit:
+            raise UnsupportedImage(f"Image is larger than {limit} pixels")
+        # Let the JPEG decoder downscale while decoding instead of after.
+        source.draft("RGB", (max(VARIANTS.values()),) * 2)
+        source.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as err:
+        raise UnsupportedImage(str(err))
+
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "transparency" in source.info or source.mode in ("LA", "P") else "RGB")
+
+    variants = []
+    for name, edge in VARIANTS.items():
+        image = source.copy()
+        image.thumbnail((edge, edge))
+        out = io.BytesIO()
+        image.save(out, format="WEBP", quality=80, method=4)
+        variants.append((name, out.getvalue()))
+    return variants
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")))
+    return _pool
+
+
+async def render_variants(data):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), _render_variants, data)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
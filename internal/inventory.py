@@ -0,0 +1,302 @@
+import os
+import threading
+import time
+import uuid
+import mysql.connector
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f"Product {product_id} is out of stock")
+        self.product_id = product_id
+
+
+class InvalidQuantity(ValueError):
+    def __init__(self, product_id):
+        super().__init__(f"Quantity for product {product_id} must be at least 1")
+        self.product_id = product_id
+
+
+def _merge(items):
+    # Sum quantities per product and lock rows in id order so two checkouts
+    # touching the same products can never deadlock each other. A zero or
+    # negative line would hand stock back, so it is refused outright.
+    totals = {}
+    for product_id, quantity in items:
+        if quantity < 1:
+            raise InvalidQuantity(product_id)
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    return sorted(totals.items())
+
+
+class DirectInventory:
+    # Conditional decrement inside the checkout transaction. The row lock is
+    # held until commit, so buyers of one hot product queue on that row.
+    mode = "direct"
+
+    def reserve(self, cursor, items):
+        for product_id, quantity in _merge(items):
+            cursor.execute(
+                "UPDATE Product SET availableItemCount = availableItemCount - %s "
+                "WHERE id = %s AND availableItemCount >= %s",
+                (quantity, product_id, quantity)
+            )
+            if cursor.rowcount == 0:
+                raise OutOfStock(product_id)
+        return None
+
+    def confirm(self, reservation):
+        pass
+
+    def cancel(self, reservation):
+        pass
+
+    def flush(self, force=False):
+        return 0
+
+    def stats(self):
+        return {"mode": self.mode}
+
+
+UPSERT_LEASE = (
+    "INSERT INTO InventoryLease (owner, product_id, quantity, expires_at) "
+    "VALUES (%s, %s, %s, UTC_TIMESTAMP() + INTERVAL %s SECOND) "
+    "ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity), expires_at = VALUES(expires_at)"
+)
+TAKE_FROM_LEASE = (
+    "UPDATE InventoryLease SET quantity = quantity - %s "
+    "WHERE owner = %s AND product_id = %s AND quantity >= %s"
+)
+
+
+class LeasedInventory:
+    # High-contention mode. Each worker leases stock from MySQL in chunks
+    # with one conditional UPDATE and serves reservations from memory, so a
+    # flash sale touches the hot Product row once per lease instead of once
+    # per buyer. Leased units are already gone from availableItemCount, which
+    # means the sum over all workers can never exceed the stock in MySQL.
+    #
+    # Every lease is also a row in InventoryLease (one per worker and
+    # product). A checkout takes its units off that row inside the checkout
+    # transaction, so the row always holds exactly the unsold units. Workers
+    # refresh expires_at on every flush; rows of a worker that died are past
+    # it and any worker's flush hands them back to Product.
+    mode = "leased"
+
+    def __init__(self, db_config, lease_size=50, lease_share=4, lease_ttl=60.0, reservation_ttl=300.0,
+                 idle_return=60.0, stripes=64):
+        self._db_config = db_config
+        self.owner = uuid.uuid4().hex
+        self.lease_size = lease_size
+        self.lease_share = lease_share
+        self.lease_ttl = lease_ttl
+        self.reservation_ttl = reservation_ttl
+        self.idle_return = idle_return
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        self._local = {}
+        self._touched = {}
+        self._reservations = {}
+        self._reservations_lock = threading.Lock()
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._stats = {
+            "leases": 0, "leased_units": 0, "returned_units": 0, "reaped_units": 0, "lost_leases": 0,
+            "reserved": 0, "expired": 0, "out_of_stock": 0,
+        }
+
+    def _lock_for(self, product_id):
+        return self._stripes[hash(product_id) % len(self._stripes)]
+
+    def _transaction(self, work):
+        # Leases use a private connection: they must not ride on the checkout
+        # transaction, and must not wait on the shared pool.
+        with self._conn_lock:
+            for attempt in (1, 2):
+                try:
+                    if self._conn is None or not self._conn.is_connected():
+                        self._conn = mysql.connector.connect(**self._db_config, autocommit=True)
+                    self._conn.start_transaction()
+                    cursor = self._conn.cursor()
+                    try:
+                        result = work(cursor)
+                        self._conn.commit()
+                        return result
+                    except BaseException:
+                        if self._conn.is_connected():
+                            self._conn.rollback()
+                        raise
+                    finally:
+                        cursor.close()
+                except mysql.connector.OperationalError:
+                    self._conn = None
+                    if attempt == 2:
+                        raise
+
+    def _lease(self, product_id, needed):
+        # Takes what the checkout needs, topped up to lease_size but never more
+        # than 1/lease_share of what is left, so the last units of a flash
+        # sale are spread over the workers instead of parked in one of them.
+        def claim(cursor):
+            cursor.execute(
+                "UPDATE Product SET availableItemCount = availableItemCount - LAST_INSERT_ID("
+                "LEAST(availableItemCount, GREATEST(%s, LEAST(%s, FLOOR(availableItemCount / %s))))) "
+                "WHERE id = %s AND availableItemCount > 0",
+                (needed, self.lease_size, self.lease_share, product_id)
+            )
+            claimed = cursor.lastrowid if cursor.rowcount else 0
+            if claimed:
+                cursor.execute(UPSERT_LEASE, (self.owner, product_id, claimed, self.lease_ttl))
+            return claimed
+
+        claimed = self._transaction(claim)
+        if claimed:
+            self._stats["leases"] += 1
+            self._stats["leased_units"] += claimed
+        return claimed
+
+    def _return_local(self, merged):
+        for product_id, quantity in merged:
+            with self._lock_for(product_id):
+                self._local[product_id] = self._local.get(product_id, 0) + quantity
+
+    def reserve(self, cursor, items):
+        merged = _merge(items)
+        taken = []
+        try:
+            for product_id, quantity in merged:
+                with self._lock_for(product_id):
+                    available = self._local.get(product_id, 0)
+                    if available < quantity:
+                        available += self._lease(product_id, quantity - available)
+                    if available < quantity:
+                        self._local[product_id] = available
+                        self._stats["out_of_stock"] += 1
+                        raise OutOfStock(product_id)
+                    self._local[product_id] = available - quantity
+                    self._touched[product_id] = time.monotonic()
+                taken.append((product_id, quantity))
+
+            # Part of the checkout transaction: commits or rolls back with it
+            for position, (product_id, quantity) in enumerate(taken):
+                cursor.execute(TAKE_FROM_LEASE, (quantity, self.owner, product_id, quantity))
+                if cursor.rowcount == 0:
+                    # The lease was reaped while this worker looked dead, so
+                    # its units are back in Product and the local count is void
+                    with self._lock_for(product_id):
+                        self._local.pop(product_id, None)
+                    self._stats["lost_leases"] += 1
+                    taken = taken[:position] + taken[position + 1:]
+                    raise OutOfStock(product_id)
+        except BaseException:
+            self._return_local(taken)
+            raise
+
+        reservation = uuid.uuid4().hex
+        with self._reservations_lock:
+            self._reservations[reservation] = (taken, time.monotonic() + self.reservation_ttl)
+            self._stats["reserved"] += 1
+        return reservation
+
+    def confirm(self, reservation):
+        # The lease row was updated in the checkout transaction, nothing left to write.
+        with self._reservations_lock:
+            self._reservations.pop(reservation, None)
+
+    def cancel(self, reservation):
+        if reservation is None:
+            return
+        with self._reservations_lock:
+            entry = self._reservations.pop(reservation, None)
+        if entry:
+            self._return_local(entry[0])
+
+    def _give_back(self, returns):
+        def give_back(cursor):
+            returned = 0
+            for quantity, product_id in returns:
+                cursor.execute(TAKE_FROM_LEASE, (quantity, self.owner, product_id, quantity))
+                # No row means it was reaped and the units are already back
+                if cursor.rowcount:
+                    cursor.execute(
+                        "UPDATE Product SET availableItemCount = availableItemCount + %s WHERE id = %s",
+                        (quantity, product_id)
+                    )
+                    returned += quantity
+            cursor.execute("DELETE FROM InventoryLease WHERE owner = %s AND quantity <= 0", (self.owner,))
+            return returned
+
+        return self._transaction(give_back)
+
+    def _heartbeat(self):
+        def refresh(cursor):
+            cursor.execute(
+                "UPDATE InventoryLease SET expires_at = UTC_TIMESTAMP() + INTERVAL %s SECOND WHERE owner = %s",
+                (self.lease_ttl, self.owner)
+            )
+        self._transaction(refresh)
+
+    def _reap(self):
+        def reap(cursor):
+            cursor.execute(
+                "SELECT owner, product_id, quantity FROM InventoryLease "
+                "WHERE expires_at < UTC_TIMESTAMP() ORDER BY product_id FOR UPDATE"
+            )
+            rows = cursor.fetchall()
+            for owner, product_id, quantity in rows:
+                if quantity > 0:
+                    cursor.execute(
+                        "UPDATE Product SET availableItemCount = availableItemCount + %s WHERE id = %s",
+                        (quantity, product_id)
+                    )
+                cursor.execute("DELETE FROM InventoryLease WHERE owner = %s AND product_id = %s", (owner, product_id))
+            return sum(max(quantity, 0) for _, _, quantity in rows)
+
+        return self._transaction(reap)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        with self._reservations_lock:
+            expired = [key for key, (_, expires_at) in self._reservations.items() if force or expires_at <= now]
+            entries = [self._reservations.pop(key) for key in expired]
+        for taken, _ in entries:
+            self._return_local(taken)
+        self._stats["expired"] += len(entries)
+
+        returns = []
+        for product_id in list(self._local):
+            with self._lock_for(product_id):
+                idle = now - self._touched.get(product_id, 0) >= self.idle_return
+                if self._local.get(product_id) and (force or idle):
+                    returns.append((self._local.pop(product_id), product_id))
+        if returns:
+            try:
+                returned = self._give_back(returns)
+            except mysql.connector.Error:
+                self._return_local([(product_id, quantity) for quantity, product_id in returns])
+                raise
+            self._stats["returned_units"] += returned
+        if self._local and not force:
+            self._heartbeat()
+        self._stats["reaped_units"] += self._reap()
+        return len(returns)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["mode"] = self.mode
+        stats["owner"] = self.owner
+        stats["local_units"] = sum(self._local.values())
+        stats["open_reservations"] = len(self._reservations)
+        return stats
+
+
+def create_inventory(db_config):
+    if os.getenv("INVENTORY_MODE", "direct") == "leased":
+        return LeasedInventory(
+            db_config,
+            lease_size=int(os.getenv("INVENTORY_LEASE_SIZE", "50")),
+            lease_share=int(os.getenv("INVENTORY_LEASE_SHARE", "4")),
+            lease_ttl=float(os.getenv("INVENTORY_LEASE_TTL", "60")),
+            reservation_ttl=float(os.getenv("INVENTORY_RESERVATION_TTL", "300")),
+            idle_return=float(os.getenv("INVENTORY_IDLE_RETURN", "60")),
+        )
+    return DirectInventory()
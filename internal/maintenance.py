@@ -0,0 +1,129 @@
+import logging
+import os
+import time
+from datetime import datetime, timezone
+import jwt
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+# Expired Token and TokenBlacklist rows are useless (verify_token rejects the
+# JWT by then) but were never removed. The pruner deletes them in small
+# autocommitted chunks with a pause in between, so no statement holds row or
+# index locks for long and replication never sees a huge transaction.
+PRUNE_TARGETS = (
+    ("Token", "expiration_time"),
+    ("TokenBlacklist", "expires_at"),
+)
+
+
+class TokenPruner:
+    def __init__(self, db_config, chunk_size=1000, pause=0.1, max_chunks=500):
+        self._db_config = db_config
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_chunks = max_chunks
+        self._stats = {"runs": 0, "skipped": 0, "removed": {table: 0 for table, _ in PRUNE_TARGETS}, "backfilled": 0}
+        self._last_run = None
+        self._sizes = {}
+
+    def _backfill_blacklist(self, cursor):
+        # Rows written before expires_at existed get it from the token's exp
+        # claim, after which they are pruned like the rest.
+        cursor.execute(
+            "SELECT id, token FROM TokenBlacklist WHERE expires_at IS NULL ORDER BY id LIMIT %s", (self.chunk_size,)
+        )
+        rows = cursor.fetchall()
+        updates = []
+        for row_id, token in rows:
+            try:
+                exp = jwt.decode(token, options={"verify_signature": False, "verify_exp": False}).get("exp")
+            except jwt.InvalidTokenError:
+                exp = None
+            # Undecodable tokens or tokens without exp can never be accepted again
+            updates.append((datetime.fromtimestamp(exp or 0, timezone.utc), row_id))
+        if updates:
+            cursor.executemany("UPDATE TokenBlacklist SET expires_at = %s WHERE id = %s", updates)
+        return len(updates)
+
+    def _prune_table(self, cursor, table, column):
+        removed = 0
+        for _ in range(self.max_chunks):
+            cursor.execute(f"DELETE FROM {table} WHERE {column} < UTC_TIMESTAMP() LIMIT %s", (self.chunk_size,))
+            removed += cursor.rowcount
+            if cursor.rowcount < self.chunk_size:
+                break
+            time.sleep(self.pause)
+        return removed
+
+    def _table_sizes(self, cursor):
+        # information_schema numbers are InnoDB estimates, good enough to
+        # watch the trend without a COUNT(*) over the whole table.
+        cursor.execute(
+            "SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables "
+            f"WHERE table_schema = DATABASE() AND table_name IN ({', '.join(['%s'] * len(PRUNE_TARGETS))})",
+            tuple(table for table, _ in PRUNE_TARGETS)
+        )
+        return {
+            name: {"approx_rows": rows, "data_bytes": data, "index_bytes": index}
+            for name, rows, data, index in cursor.fetchall()
+        }
+
+    def run(self):
+        # Own autocommit connection: the run sleeps between chunks and must
+        # not keep a pool connection busy. GET_LOCK makes sure only one
+        # worker prunes at a time.
+        started = time.monotonic()
+        conn = mysql.connector.connect(**self._db_config, autocommit=True)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT GET_LOCK('token_prune', 0)")
+            if cursor.fetchone()[0] != 1:
+                self._stats["skipped"] += 1
+                return None
+            try:
+                backfilled = 0
+                for _ in range(self.max_chunks):
+                    count = self._backfill_blacklist(cursor)
+                    backfilled += count
+                    if count < self.chunk_size:
+                        break
+                    time.sleep(self.pause)
+                removed = {table: self._prune_table(cursor, table, column) for table, column in PRUNE_TARGETS}
+                self._sizes = self._table_sizes(cursor)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('token_prune')")
+                cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+        self._stats["runs"] += 1
+        self._stats["backfilled"] += backfilled
+        for table, count in removed.items():
+            self._stats["removed"][table] += count
+        self._last_run = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "removed": removed,
+            "backfilled": backfilled,
+        }
+        logger.info("Pruned expired tokens: %s, table sizes: %s", removed, self._sizes)
+        return removed
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["removed"] = dict(self._stats["removed"])
+        stats["last_run"] = self._last_run
+        stats["tables"] = self._sizes
+        stats["chunk_size"] = self.chunk_size
+        return stats
+
+
+def create_pruner(db_config):
+    return TokenPruner(
+        db_config,
+        chunk_size=int(os.getenv("TOKEN_PRUNE_CHUNK", "1000")),
+        pause=float(os.getenv("TOKEN_PRUNE_PAUSE", "0.1")),
+        max_chunks=int(os.getenv("TOKEN_PRUNE_MAX_CHUNKS", "500")),
+    )
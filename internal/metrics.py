@@ -0,0 +1,229 @@
+import contextvars
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from internal.config import env_bool
+
+# In-process counters and histograms rendered in the Prometheus text format
+# on /metrics. Every worker keeps its own numbers; scrape each worker (or sum
+# them) rather than expecting one process to see the whole fleet.
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+# Queries run while serving the current request, collected only when the
+# slow request sampler is on. run_blocking copies the context, so queries
+# made from executor threads land in the same list.
+_query_log = contextvars.ContextVar("query_log", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._series.items())
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, (('le', _number(bound)),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name, kind, help, labelnames, collect):
+        # collect() returns (label values, value) pairs read at scrape time,
+        # for numbers another component already keeps (pool, caches).
+        self._collectors.append((name, kind, help, labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, kind, help, labelnames, collect in self._collectors:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in collect():
+                lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+http_requests = registry.counter(
+    "http_requests_total", "Requests served, by route template and status code.", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route")
+)
+db_queries = registry.histogram(
+    "db_query_duration_seconds", "Time spent in cursor execute calls, by statement fingerprint.", ("statement",)
+)
+bcrypt_duration = registry.histogram(
+    "bcrypt_duration_seconds", "Time bcrypt spends hashing or verifying, excluding queueing.", ("operation",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0),
+)
+payment_duration = registry.histogram(
+    "payment_request_duration_seconds", "Midtrans Snap calls per attempt, by outcome.", ("outcome",)
+)
+admission_decisions = registry.counter(
+    "admission_decisions_total", "Requests admitted, throttled (429) or shed (503) by admission control.", ("rule", "decision")
+)
+
+
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement):
+    # Placeholders and literals become ?, and IN/VALUES lists collapse, so
+    # the same query built for a different number of ids is one series.
+    if isinstance(statement, (bytes, bytearray)):
+        statement = statement.decode("utf-8", "replace")
+    statement = _SPACE.sub(" ", statement).strip()
+    statement = _LITERAL.sub("?", statement)
+    statement = _LIST.sub("(?, ...)", statement)
+    return statement[:200]
+
+
+def observe_query(statement, seconds):
+    statement = fingerprint(statement)
+    db_queries.observe((statement,), seconds)
+    log = _query_log.get()
+    if log is not None:
+        log.append((statement, seconds))
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware rather than @app.middleware("http") so streaming
+    # responses are timed to their last byte and are not buffered.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [] if SLOW_REQUEST_MS > 0 else None
+        token = _query_log.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _query_log.reset(token)
+            # The router stores the matched route in the scope; the template
+            # keeps label cardinality bounded.
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_requests.inc((scope["method"], path, str(status[0])))
+            http_duration.observe((scope["method"], path), elapsed)
+            if queries is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(scope["method"], scope["path"], status[0], elapsed, queries)
+
+
+def _log_slow_request(method, path, status, elapsed, queries):
+    breakdown = {}
+    for statement, seconds in queries:
+        count, total = breakdown.get(statement, (0, 0.0))
+        breakdown[statement] = (count + 1, total + seconds)
+    db_total = sum(total for _, total in breakdown.values())
+    lines = [
+        f"  {total * 1000:8.1f} ms  x{count:<4} {statement}"
+        for statement, (count, total) in sorted(breakdown.items(), key=lambda item: item[1][1], reverse=True)[:10]
+    ]
+    logger.warning(
+        "Slow request %s %s -> %s in %.1f ms, %d queries took %.1f ms\n%s",
+        method, path, status, elapsed * 1000, len(queries), db_total * 1000, "\n".join(lines),
+    )
+
+
+def render():
+    return registry.render()
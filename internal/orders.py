@@ -0,0 +1,74 @@
+import os
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+CENT = Decimal("0.01")
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class OrderNumbersExhausted(Exception):
+    pass
+
+
+class OrderNumberAllocator:
+    # Hands out order numbers without a uniqueness probe per checkout.
+    # Each worker reserves a block of sequence values with one statement on
+    # OrderNumberSequence (hi/lo), and every sequence value is mapped to an
+    # order number through an affine permutation of the fixed-width range,
+    # so numbers stay unique but are not trivially guessable from each other.
+    def __init__(self, get_connection, digits=8, block_size=100, multiplier=7919849, offset=104729):
+        self._get_connection = get_connection
+        self.block_size = block_size
+        self.digits = digits
+        self._low = 10 ** (digits - 1)
+        self._space = 9 * self._low
+        if any(multiplier % p == 0 for p in (2, 3, 5)):
+            raise ValueError("multiplier must be coprime with the order number space")
+        self._multiplier = multiplier
+        self._offset = offset
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        # Runs on its own connection and commits right away, so the sequence
+        # row lock is never held for the length of a checkout transaction.
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO OrderNumberSequence (id, next_value) VALUES (1, LAST_INSERT_ID(%s)) "
+                "ON DUPLICATE KEY UPDATE next_value = LAST_INSERT_ID(next_value + %s)",
+                (self.block_size, self.block_size)
+            )
+            end = cursor.lastrowid
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return end - self.block_size, end
+
+    def next_number(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+            value = self._next
+            self._next += 1
+        # Past the size of the range the permutation wraps around and would
+        # hand out numbers that are already taken.
+        if value >= self._space:
+            raise OrderNumbersExhausted(
+                f"All {self._space} order numbers of {self.digits} digits are used, raise ORDER_NUMBER_DIGITS"
+            )
+        return self._low + (self._multiplier * value + self._offset) % self._space
+
+
+def create_allocator(get_connection):
+    return OrderNumberAllocator(
+        get_connection,
+        digits=int(os.getenv("ORDER_NUMBER_DIGITS", "8")),
+        block_size=int(os.getenv("ORDER_NUMBER_BLOCK", "100")),
+    )
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Work that has to follow a committed checkout (payment link, first OrderLog
+# entry, shipment) is written to OrderOutbox in the checkout transaction and
+# carried out here, so the customer never waits on it and nothing is lost if
+# the process dies in between.
+
+
+def outbox_rows(order_id, events):
+    return [(order_id, event_type, json.dumps(payload)) for event_type, payload in events]
+
+
+INSERT_OUTBOX = "INSERT INTO OrderOutbox (order_id, event_type, payload, status, available_at) VALUES (%s, %s, %s, 'pending', NOW())"
+
+
+class OutboxDispatcher:
+    def __init__(self, get_connection, run_blocking, handlers, batch_size=20, concurrency=8,
+                 poll_seconds=1.0, max_attempts=8, lease_seconds=60):
+        # handlers maps event_type to an async callable taking the decoded
+        # event and returning (statement, params) pairs that are committed
+        # together with marking the event done.
+        self._get_connection = get_connection
+        self._run_blocking = run_blocking
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._concurrency = concurrency
+        self._wakeup = None
+        self._stats = {"dispatched": 0, "retried": 0, "failed": 0}
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _claim(self):
+        # SKIP LOCKED lets several workers drain the outbox side by side. A
+        # claimed row is leased; if its worker dies the lease runs out and the
+        # row is picked up again.
+        conn = self._get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT id, order_id, event_type, payload, attempts FROM OrderOutbox "
+                "WHERE status IN ('pending', 'processing') AND available_at <= NOW() "
+                "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                (self.batch_size,)
+            )
+            events = cursor.fetchall()
+            if events:
+                ids = [event["id"] for event in events]
+                cursor.execute(
+                    f"UPDATE OrderOutbox SET status = 'processing', available_at = NOW() + INTERVAL %s SECOND "
+                    f"WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                    (self.lease_seconds, *ids)
+                )
+            conn.commit()
+            return events
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _complete(self, event_id, statements):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            for statement, params in statements:
+                cursor.execute(statement, params)
+            cursor.execute("UPDATE OrderOutbox SET status = 'done', last_error = NULL WHERE id = %s", (event_id,))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _fail(self, event_id, attempts, error):
+        status = "failed" if attempts >= self.max_attempts else "pending"
+        delay = min(2 ** attempts, 300)
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE OrderOutbox SET status = %s, attempts = %s, last_error = %s, "
+                "available_at = NOW() + INTERVAL %s SECOND WHERE id = %s",
+                (status, attempts, str(error)[:1000], delay, event_id)
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return status
+
+    async def _process(self, event, slots):
+        async with slots:
+            handler = self.handlers.get(event["event_type"])
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for outbox event {event['event_type']}")
+                payload = event["payload"]
+                event["payload"] = json.loads(payload) if isinstance(payload, (str, bytes, bytearray)) else payload
+                statements = await handler(event)
+                await self._run_blocking(self._complete, event["id"], statements or [])
+                self._stats["dispatched"] += 1
+            except Exception as err:
+                logger.warning("Outbox event %s (%s) failed: %s", event["id"], event["event_type"], err)
+                status = await self._run_blocking(self._fail, event["id"], event["attempts"] + 1, err)
+                self._stats["failed" if status == "failed" else "retried"] += 1
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(self._concurrency)
+        while True:
+            try:
+                events = await self._run_blocking(self._claim)
+            except Exception:
+                logger.exception("Claiming outbox events failed")
+                events = []
+            if events:
+                await asyncio.gather(*(self._process(event, slots) for event in events))
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return dict(self._stats)
+
+
+def create_dispatcher(get_connection, run_blocking, handlers):
+    return OutboxDispatcher(
+        get_connection,
+        run_blocking,
+        handlers,
+        batch_size=int(os.getenv("OUTBOX_BATCH", "20")),
+        concurrency=int(os.getenv("OUTBOX_CONCURRENCY", "8")),
+        poll_seconds=float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+        max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+    )
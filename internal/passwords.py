@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from internal.metrics import bcrypt_duration
+
+# bcrypt is CPU bound (~100-300 ms per call at cost 12), so it runs in its own
+# process pool. At most BCRYPT_WORKERS calls run at once and at most
+# BCRYPT_MAX_QUEUE wait behind them; anything beyond that is refused so a login
+# storm cannot pile up unbounded work.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Every web worker has its own pool, so the default splits half the cpus
+# between the WEB_CONCURRENCY workers serve.py starts.
+BCRYPT_WORKERS = int(os.getenv(
+    "BCRYPT_WORKERS", str(max((os.cpu_count() or 2) // 2 // int(os.getenv("WEB_CONCURRENCY", "1")), 1))
+))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "64"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+_waiting = 0
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _hashpw(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _checkpw(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+    return _pool
+
+
+async def _run(operation, func, *args):
+    global _slots, _waiting
+    if _slots is None:
+        _slots = asyncio.Semaphore(BCRYPT_WORKERS)
+    if _slots.locked() and _waiting >= BCRYPT_MAX_QUEUE:
+        raise Overloaded("Too many password operations in progress, try again later")
+    _waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _waiting -= 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), func, *args)
+    finally:
+        _slots.release()
+        bcrypt_duration.observe((operation,), time.perf_counter() - start)
+
+
+async def hash_password(password, rounds=None):
+    return await _run("hash", _hashpw, password, rounds or BCRYPT_ROUNDS)
+
+
+async def verify_password(password, hashed):
+    return await _run("verify", _checkpw, password, hashed)
+
+
+async def warm_up():
+    # Starts every worker process and imports bcrypt in it with a minimum
+    # cost hash, so the first logins after a deploy do not wait for that.
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, _hashpw, "warm-up", 4) for _ in range(BCRYPT_WORKERS)))
+
+
+def needs_rehash(hashed):
+    # Modular crypt format: $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split("$")[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def stats():
+    return {
+        "rounds": BCRYPT_ROUNDS,
+        "workers": BCRYPT_WORKERS,
+        "max_queue": BCRYPT_MAX_QUEUE,
+        "waiting": _waiting,
+    }
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,168 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The queries every request path runs, kept as module-level constants and
+# executed through PooledConnection.prepared(), so each pooled connection
+# prepares them once on the server and afterwards only sends parameters.
+# Results are always read in full: a prepared cursor is shared by every
+# checkout of its connection and must not be left with pending rows.
+
+PRODUCT_SUMMARY_COLUMNS = (
+    "id, name, description, price, availableItemCount, categoryId, owner_uuid, image IS NOT NULL, image_hash"
+)
+
+FIND_LOGIN = "SELECT uuid, password FROM Customer WHERE email = %s"
+TOKEN_BLACKLISTED = "SELECT 1 FROM TokenBlacklist WHERE token = %s LIMIT 1"
+BLACKLIST_PAGE = "SELECT id, token FROM TokenBlacklist WHERE id > %s ORDER BY id LIMIT %s"
+PRODUCT_BY_ID = f"SELECT {PRODUCT_SUMMARY_COLUMNS} FROM Product WHERE id = %s"
+PRODUCT_PAGE = f"SELECT {PRODUCT_SUMMARY_COLUMNS} FROM Product WHERE id > %s ORDER BY id LIMIT %s"
+# Creates the cart on first use; relies on the unique key on owner, and
+# LAST_INSERT_ID(cartId) hands back the existing id when there is one.
+# Every cart write goes through here, so it also bumps the version that
+# cached carts are keyed on.
+UPSERT_CART = (
+    "INSERT INTO ShoppingCart (owner) VALUES (%s) "
+    "ON DUPLICATE KEY UPDATE cartId = LAST_INSERT_ID(cartId), version = version + 1"
+)
+CART_VERSION = "SELECT version FROM ShoppingCart WHERE owner = %s"
+# Stock leased by workers in INVENTORY_MODE=leased is gone from
+# availableItemCount but still for sale, so the soft stock checks add it back.
+LEASED_STOCK = "COALESCE((SELECT SUM(l.quantity) FROM InventoryLease l WHERE l.product_id = p.id), 0)"
+# Needs the (cartId, productId) unique key for the ON DUPLICATE KEY branch
+ADD_CART_ITEM = (
+    "INSERT INTO ShoppingCartItem (cartId, productId, quantity) "
+    f"SELECT %s, p.id, %s FROM Product p WHERE p.id = %s AND p.availableItemCount + {LEASED_STOCK} >= %s "
+    "ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)"
+)
+READ_CART = (
+    "SELECT sc.cartId, sci.productId AS product_id, p.name, sci.quantity, p.price "
+    "FROM ShoppingCart sc "
+    "LEFT JOIN ShoppingCartItem sci ON sci.cartId = sc.cartId "
+    "LEFT JOIN Product p ON sci.productId = p.id "
+    "WHERE sc.owner = %s ORDER BY sci.productId"
+)
+CHECKOUT_LINES = (
+    "SELECT sci.productId AS product_id, p.name, p.price, sci.quantity "
+    "FROM ShoppingCartItem sci JOIN Product p ON sci.productId = p.id "
+    "WHERE sci.cartId = %s AND sci.cartId = (SELECT cartId FROM ShoppingCart WHERE owner = %s)"
+)
+ORDER_PAYMENT = (
+    "SELECT o.payment_url, ob.status, ob.last_error FROM CustomerOrder o "
+    "LEFT JOIN OrderOutbox ob ON ob.order_id = o.id AND ob.event_type = 'payment_link' "
+    "WHERE o.orderNumber = %s AND o.customer = %s"
+)
+
+
+def _first(rows):
+    return rows[0] if rows else None
+
+
+def find_login(conn, email):
+    cursor = conn.prepared(FIND_LOGIN)
+    cursor.execute(FIND_LOGIN, (email,))
+    return _first(cursor.fetchall())
+
+
+def token_blacklisted(conn, token):
+    cursor = conn.prepared(TOKEN_BLACKLISTED)
+    cursor.execute(TOKEN_BLACKLISTED, (token,))
+    return bool(cursor.fetchall())
+
+
+def blacklist_page(conn, after_id, limit):
+    cursor = conn.prepared(BLACKLIST_PAGE)
+    cursor.execute(BLACKLIST_PAGE, (after_id, limit))
+    return cursor.fetchall()
+
+
+def product_by_id(conn, product_id):
+    cursor = conn.prepared(PRODUCT_BY_ID)
+    cursor.execute(PRODUCT_BY_ID, (product_id,))
+    return _first(cursor.fetchall())
+
+
+def product_page(conn, after_id, limit):
+    cursor = conn.prepared(PRODUCT_PAGE)
+    cursor.execute(PRODUCT_PAGE, (after_id, limit))
+    return cursor.fetchall()
+
+
+def cart_id(conn, owner):
+    cursor = conn.prepared(UPSERT_CART)
+    cursor.execute(UPSERT_CART, (owner,))
+    return cursor.lastrowid
+
+
+def add_cart_item(conn, cart, product_id, quantity):
+    cursor = conn.prepared(ADD_CART_ITEM)
+    cursor.execute(ADD_CART_ITEM, (cart, quantity, product_id, quantity))
+    return cursor.rowcount > 0
+
+
+def cart_version(conn, owner):
+    cursor = conn.prepared(CART_VERSION)
+    cursor.execute(CART_VERSION, (owner,))
+    row = _first(cursor.fetchall())
+    return row[0] if row else None
+
+
+def read_cart(conn, owner):
+    cursor = conn.prepared(READ_CART, dictionary=True)
+    cursor.execute(READ_CART, (owner,))
+    return cursor.fetchall()
+
+
+def checkout_lines(conn, cart, owner):
+    cursor = conn.prepared(CHECKOUT_LINES, dictionary=True)
+    cursor.execute(CHECKOUT_LINES, (cart, owner))
+    return cursor.fetchall()
+
+
+def order_payment(conn, order_number, customer):
+    cursor = conn.prepared(ORDER_PAYMENT)
+    cursor.execute(ORDER_PAYMENT, (order_number, customer))
+    return _first(cursor.fetchall())
+
+
+# Read-only hot queries with parameters that look like real traffic, for the
+# startup EXPLAIN check. The cart writes are left out.
+HOT_QUERIES = [
+    ("login", FIND_LOGIN, ("someone@example.com",)),
+    ("token blacklist", TOKEN_BLACKLISTED, ("token",)),
+    ("blacklist page", BLACKLIST_PAGE, (0, 1000)),
+    ("product by id", PRODUCT_BY_ID, (1,)),
+    ("product page", PRODUCT_PAGE, (0, 50)),
+    ("cart version", CART_VERSION, ("00000000-0000-0000-0000-000000000000",)),
+    ("cart", READ_CART, ("00000000-0000-0000-0000-000000000000",)),
+    ("checkout lines", CHECKOUT_LINES, (1, "00000000-0000-0000-0000-000000000000")),
+    ("order payment", ORDER_PAYMENT, (1, "00000000-0000-0000-0000-000000000000")),
+]
+
+
+def _full_scans(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    return [row for row in cursor.fetchall() if str(row.get("type") or "").upper() == "ALL"]
+
+
+def check_query_plans(get_connection):
+    # A plan with type ALL reads the whole table on every call, which almost
+    # always means one of the keys from internal.schema is missing. Small or
+    # empty tables can get such a plan anyway, so this only warns.
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    findings = {}
+    try:
+        for name, sql, params in HOT_QUERIES:
+            scans = _full_scans(cursor, sql, params)
+            for row in scans:
+                logger.warning(
+                    "Hot query %r does a full scan of %s (possible keys: %s, rows: %s)",
+                    name, row.get("table"), row.get("possible_keys") or "none", row.get("rows")
+                )
+            if scans:
+                findings[name] = [row.get("table") for row in scans]
+    finally:
+        cursor.close()
+        conn.close()
+    return findings
@@ -0,0 +1,78 @@
+import hashlib
+import heapq
+import threading
+import time
+import jwt
+
+
+def token_id(token, payload=None):
+    # Tokens issued before jti was added are keyed by their digest instead.
+    if payload and payload.get("jti"):
+        return payload["jti"]
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class RevocationList:
+    # In-memory mirror of TokenBlacklist. Entries drop out on their own once
+    # the token's exp has passed, since verify_token rejects it by then.
+    def __init__(self):
+        self._revoked = {}
+        self._expiry_heap = []
+        self._last_row_id = 0
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.refreshed_at = None
+
+    def is_revoked(self, key):
+        return key in self._revoked
+
+    def revoke(self, key, exp):
+        with self._lock:
+            self._add(key, exp)
+
+    def _add(self, key, exp):
+        if exp is not None and exp <= time.time():
+            return
+        self._revoked[key] = exp
+        if exp is not None:
+            heapq.heappush(self._expiry_heap, (exp, key))
+
+    def purge_expired(self, now=None):
+        now = now or time.time()
+        removed = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                exp, key = heapq.heappop(self._expiry_heap)
+                if self._revoked.get(key) == exp:
+                    del self._revoked[key]
+                    removed += 1
+        return removed
+
+    def refresh(self, fetch_rows, batch_size=5000):
+        # fetch_rows(after_id, limit) returns (id, token) rows in id order.
+        added = 0
+        while True:
+            rows = fetch_rows(self._last_row_id, batch_size)
+            with self._lock:
+                for row_id, token in rows:
+                    try:
+                        payload = jwt.decode(token, options={"verify_signature": False, "verify_exp": False})
+                    except jwt.InvalidTokenError:
+                        payload = {}
+                    self._add(token_id(token, payload), payload.get("exp"))
+                    self._last_row_id = max(self._last_row_id, row_id)
+                    added += 1
+            if len(rows) < batch_size:
+                break
+        self.loaded = True
+        self.refreshed_at = time.time()
+        self.purge_expired()
+        return added
+
+    def stats(self):
+        return {
+            "revoked": len(self._revoked),
+            "last_row_id": self._last_row_id,
+            "loaded": self.loaded,
+            "refreshed_at": self.refreshed_at,
+        }
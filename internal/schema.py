@@ -0,0 +1,321 @@
+import argparse
+import logging
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema. Every step is idempotent (CREATE TABLE IF NOT EXISTS,
+# columns and indexes only added when information_schema says they are
+# missing), so it brings both an empty database and one that was built by
+# hand up to what main.py expects. Applied versions go in SchemaVersion.
+#   python -m internal.schema            apply pending migrations
+#   python -m internal.schema --status   list applied and pending versions
+
+
+class MigrationError(Exception):
+    pass
+
+
+def create_table(ddl):
+    def apply(cursor):
+        cursor.execute(ddl)
+    return apply
+
+
+def run(statement):
+    # Data migrations; the statement itself has to be safe to run twice
+    def apply(cursor):
+        cursor.execute(statement)
+    return apply
+
+
+def add_column(table, column, definition):
+    def apply(cursor):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+            (table, column)
+        )
+        if not cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return apply
+
+
+def _text(value):
+    # Some server versions hand information_schema strings back as bytes
+    return value.decode("utf-8") if isinstance(value, (bytes, bytearray)) else value
+
+
+def _existing_indexes(cursor, table):
+    cursor.execute(
+        "SELECT index_name AS name, column_name AS col, non_unique AS non_unique, index_type AS kind "
+        "FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s "
+        "ORDER BY index_name, seq_in_index",
+        (table,)
+    )
+    indexes = {}
+    for name, column, non_unique, kind in cursor.fetchall():
+        entry = indexes.setdefault(_text(name), {"columns": [], "unique": not int(non_unique), "kind": _text(kind)})
+        entry["columns"].append(_text(column).lower())
+    return indexes.values()
+
+
+def add_index(table, name, columns, kind=""):
+    # columns may carry a prefix length, e.g. "token(255)". An existing index
+    # counts when it already serves the lookup: same leading columns, and
+    # unique/fulltext when that is what is asked for.
+    wanted = [column.split("(")[0].strip().lower() for column in columns]
+
+    def satisfied(index):
+        if kind == "FULLTEXT":
+            return index["kind"] == "FULLTEXT" and sorted(index["columns"]) == sorted(wanted)
+        if index["kind"] == "FULLTEXT":
+            return False
+        if kind == "UNIQUE":
+            return index["unique"] and index["columns"] == wanted
+        return index["columns"][:len(wanted)] == wanted
+
+    def apply(cursor):
+        if any(satisfied(index) for index in _existing_indexes(cursor, table)):
+            return
+        try:
+            cursor.execute(f"ALTER TABLE {table} ADD {kind + ' ' if kind else ''}INDEX {name} ({', '.join(columns)})")
+        except mysql.connector.IntegrityError as err:
+            raise MigrationError(
+                f"{table} has duplicate rows for ({', '.join(wanted)}), remove them and migrate again: {err}"
+            )
+    return apply
+
+
+MIGRATIONS = [
+    (1, "base tables", [
+        create_table(
+            "CREATE TABLE IF NOT EXISTS Customer ("
+            " uuid CHAR(36) NOT NULL PRIMARY KEY, userName VARCHAR(255) NOT NULL, name VARCHAR(255) NULL,"
+            " email VARCHAR(255) NOT NULL, password VARCHAR(255) NOT NULL, phone VARCHAR(32) NULL,"
+            " shippingAddress TEXT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS Token ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, token VARCHAR(512) NOT NULL,"
+            " user_uuid CHAR(36) NOT NULL, expiration_time DATETIME NOT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS TokenBlacklist ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, token VARCHAR(512) NOT NULL, uuid CHAR(36) NOT NULL)"
+        ),
+        # The revocation list pages through the blacklist by id
+        add_column("TokenBlacklist", "id", "BIGINT NOT NULL AUTO_INCREMENT UNIQUE FIRST"),
+        create_table("CREATE TABLE IF NOT EXISTS Category (id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, name VARCHAR(255) NOT NULL)"),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS Product ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, name VARCHAR(255) NOT NULL, description TEXT NOT NULL,"
+            " price DECIMAL(12, 2) NOT NULL, availableItemCount INT NOT NULL DEFAULT 0, categoryId INT NULL,"
+            " owner_uuid CHAR(36) NOT NULL, image LONGBLOB NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS ProductCategoryMapping ("
+            " product_id BIGINT NOT NULL, category_id INT NOT NULL, PRIMARY KEY (product_id, category_id))"
+        ),
+        create_table("CREATE TABLE IF NOT EXISTS ShoppingCart (cartId BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, owner CHAR(36) NOT NULL)"),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS ShoppingCartItem ("
+            " cartId BIGINT NOT NULL, productId BIGINT NOT NULL, quantity INT NOT NULL, PRIMARY KEY (cartId, productId))"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS CustomerOrder ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, orderNumber BIGINT NOT NULL,"
+            " total_amount DECIMAL(14, 2) NOT NULL, status VARCHAR(32) NOT NULL, customer CHAR(36) NOT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS orderItems ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, orderId BIGINT NOT NULL, productId BIGINT NOT NULL,"
+            " quantity INT NOT NULL, price DECIMAL(12, 2) NOT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS Shipment ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, order_id BIGINT NOT NULL, shipment_status VARCHAR(32) NOT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS OrderLog ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, order_id BIGINT NOT NULL, order_status VARCHAR(32) NOT NULL)"
+        ),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS ShipmentLog ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, shipment_id BIGINT NOT NULL, shipment_status VARCHAR(32) NOT NULL)"
+        ),
+    ]),
+    (2, "product image metadata and variants", [
+        add_column("Product", "image_hash", "CHAR(64) NULL"),
+        add_column("Product", "image_type", "VARCHAR(64) NULL"),
+        add_column("Product", "image_size", "INT NULL"),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS ProductImageVariant ("
+            " product_id BIGINT NOT NULL, variant VARCHAR(16) NOT NULL, image MEDIUMBLOB NOT NULL,"
+            " image_hash CHAR(64) NOT NULL, image_type VARCHAR(64) NOT NULL, image_size INT NOT NULL,"
+            " PRIMARY KEY (product_id, variant))"
+        ),
+    ]),
+    (3, "checkout: order numbers, outbox, order history", [
+        create_table("CREATE TABLE IF NOT EXISTS OrderNumberSequence (id INT NOT NULL PRIMARY KEY, next_value BIGINT NOT NULL)"),
+        add_column("CustomerOrder", "payment_url", "VARCHAR(512) NULL"),
+        add_column("CustomerOrder", "created", "DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)"),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS OrderOutbox ("
+            " id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY, order_id BIGINT NOT NULL, event_type VARCHAR(32) NOT NULL,"
+            " payload TEXT NOT NULL, status VARCHAR(16) NOT NULL, attempts INT NOT NULL DEFAULT 0,"
+            " last_error TEXT NULL, available_at DATETIME NOT NULL)"
+        ),
+        add_index("OrderOutbox", "ix_outbox_ready", ["status", "available_at"]),
+        add_index("OrderOutbox", "ix_outbox_order", ["order_id", "event_type"]),
+        create_table(
+            "CREATE TABLE IF NOT EXISTS CustomerOrderStats ("
+            " customer CHAR(36) NOT NULL PRIMARY KEY, order_count INT NOT NULL,"
+            " lifetime_spend DECIMAL(16, 2) NOT NULL, last_order_at DATETIME NOT NULL)"
+        ),
+    ]),
+    (4, "keys for hot lookups", [
+        add_index("Customer", "uq_customer_email", ["email"], "UNIQUE"),
+        add_index("Token", "ix_token_user", ["user_uuid"]),
+        add_index("TokenBlacklist", "ix_blacklist_token", ["token(255)"]),
+        # cart creation and add_to_cart rely on these for ON DUPLICATE KEY
+        add_index("ShoppingCart", "uq_cart_owner", ["owner"], "UNIQUE"),
+        add_index("ShoppingCartItem", "uq_cart_item", ["cartId", "productId"], "UNIQUE"),
+        add_index("CustomerOrder", "uq_order_number", ["orderNumber"], "UNIQUE"),
+        add_index("CustomerOrder", "ix_order_customer_created", ["customer", "created", "id"]),
+        add_index("orderItems", "ix_items_order", ["orderId"]),
+        add_index("orderItems", "ix_items_product", ["productId"]),
+    ]),
+    (5, "search and tracking indexes", [
+        add_index("Product", "ft_product_text", ["name", "description"], "FULLTEXT"),
+        add_index("Product", "ix_product_owner", ["owner_uuid"]),
+        add_index("ProductCategoryMapping", "ix_mapping_product", ["product_id", "category_id"]),
+        add_index("ProductCategoryMapping", "ix_mapping_category", ["category_id"]),
+        add_index("Shipment", "ix_shipment_order", ["order_id"]),
+        add_index("ShipmentLog", "ix_shipmentlog_shipment", ["shipment_id", "id"]),
+        add_index("OrderLog", "ix_orderlog_order", ["order_id", "id"]),
+    ]),
+    (6, "catalog version counter", [
+        create_table(
+            "CREATE TABLE IF NOT EXISTS CatalogVersion ("
+            " id INT NOT NULL PRIMARY KEY, version BIGINT NOT NULL, updated_at DATETIME NOT NULL)"
+        ),
+    ]),
+    (7, "token expiry for pruning", [
+        add_column("TokenBlacklist", "expires_at", "DATETIME NULL"),
+        add_index("Token", "ix_token_expiration", ["expiration_time"]),
+        add_index("TokenBlacklist", "ix_blacklist_expires", ["expires_at"]),
+    ]),
+    (8, "inventory leases", [
+        create_table(
+            "CREATE TABLE IF NOT EXISTS InventoryLease ("
+            " owner CHAR(32) NOT NULL, product_id BIGINT NOT NULL, quantity INT NOT NULL, expires_at DATETIME NOT NULL,"
+            " PRIMARY KEY (owner, product_id), KEY ix_lease_product (product_id), KEY ix_lease_expires (expires_at))"
+        ),
+    ]),
+    (9, "cart version", [
+        add_column("ShoppingCart", "version", "BIGINT NOT NULL DEFAULT 0"),
+    ]),
+    # CustomerOrderStats only counted orders placed after version 3; this
+    # recomputes every customer's totals from CustomerOrder.
+    (10, "backfill order stats", [
+        run(
+            "INSERT INTO CustomerOrderStats (customer, order_count, lifetime_spend, last_order_at) "
+            "SELECT customer, COUNT(*), SUM(total_amount), MAX(created) FROM CustomerOrder GROUP BY customer "
+            "ON DUPLICATE KEY UPDATE order_count = VALUES(order_count), "
+            "lifetime_spend = VALUES(lifetime_spend), last_order_at = VALUES(last_order_at)"
+        ),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS SchemaVersion ("
+        " version INT NOT NULL PRIMARY KEY, description VARCHAR(255) NOT NULL,"
+        " applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+
+def applied_versions(conn):
+    # Read only: used for --status and when SCHEMA_AUTO_MIGRATE is off, so a
+    # missing SchemaVersion means nothing was applied yet, not one to create.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = 'SchemaVersion'"
+        )
+        if not cursor.fetchall():
+            return set()
+        cursor.execute("SELECT version FROM SchemaVersion")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def pending(conn):
+    applied = applied_versions(conn)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+
+def migrate(conn, lock_timeout=60):
+    # DDL commits implicitly in MySQL, so a version is recorded right after
+    # its steps; an interrupted run resumes at the first unrecorded version.
+    # GET_LOCK keeps workers starting at the same time from racing.
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK('schema_migrate', %s)", (lock_timeout,))
+        if cursor.fetchone()[0] != 1:
+            raise MigrationError("Another process is migrating the schema")
+        try:
+            _ensure_version_table(cursor)
+            cursor.execute("SELECT version FROM SchemaVersion")
+            applied = {row[0] for row in cursor.fetchall()}
+            done = []
+            for version, description, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info("Applying schema version %s: %s", version, description)
+                for step in steps:
+                    step(cursor)
+                cursor.execute(
+                    "INSERT INTO SchemaVersion (version, description) VALUES (%s, %s)", (version, description)
+                )
+                conn.commit()
+                done.append(version)
+            return done
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('schema_migrate')")
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    from internal.db import config_from_env
+
+    parser = argparse.ArgumentParser(description="Apply or list schema migrations.")
+    parser.add_argument("--status", action="store_true", help="only list applied and pending versions")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    conn = mysql.connector.connect(**config_from_env())
+    try:
+        if args.status:
+            todo = pending(conn)
+            for version, description, _ in MIGRATIONS:
+                state = "pending" if (version, description) in todo else "applied"
+                print(f"{version:>3}  {state:<8} {description}")
+            return
+        done = migrate(conn)
+        print(f"applied {', '.join(map(str, done))}" if done else f"schema is at version {LATEST_VERSION}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,89 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Path, Form
-from fastapi.responses import HTMLResponse
+import time
+# Cold start is measured from here, before the heavy imports
+IMPORT_STARTED = time.perf_counter()
+from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Path, Form, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import mysql.connector
 import os
 from dotenv import load_dotenv
-import bcrypt
 import uuid
+import hmac
+import threading
 import jwt
 from datetime import datetime, timedelta, timezone
 from fastapi.middleware.cors import CORSMiddleware
+load_dotenv()
+from external.payment import create_payment_client, PaymentError
+from internal.db import config_from_env, create_pool, PoolTimeout
+from internal import repository
+from internal.repository import LEASED_STOCK, PRODUCT_SUMMARY_COLUMNS
+from internal.schema import LATEST_VERSION, migrate, pending as pending_migrations
+from internal.cache import TTLCache
+from internal.catalog import create_catalog_version
+from internal.http_cache import choose_encoding, compress, http_date, not_modified, supported_encodings
+from internal.metrics import MetricsMiddleware, METRICS_ENABLED, registry as metrics_registry, render as render_metrics
+from internal.config import env_bool
+from internal.revocation import RevocationList, token_id
+from internal.passwords import (
+    hash_password, verify_password, needs_rehash, Overloaded, stats as password_stats,
+    shutdown as shutdown_password_pool, warm_up as warm_up_passwords,
+)
+from internal.orders import create_allocator, money, OrderNumbersExhausted
+from internal.inventory import create_inventory, InvalidQuantity, OutOfStock
+from internal.bulk import (
+    BulkSpec, BULK_CHUNK_SIZE, BULK_MAX_BYTES, BULK_MAX_ITEMS, ROW_CONFLICT, BatchTooLarge,
+    validate, insert_chunk, iter_ndjson_lines, parse_line, read_limited, summarize, topics,
+)
+from internal.events import LogNotifier
+from internal.outbox import create_dispatcher, outbox_rows, INSERT_OUTBOX
+from internal.maintenance import create_pruner
+from internal.admission import AdmissionMiddleware, create_admission
+from internal.executor import run_blocking, shutdown as shutdown_executor
+from internal.images import (
+    detect_image_type, image_hash, parse_range, RangeNotSatisfiable,
+    read_upload, render_variants, ImageTooLarge, UnsupportedImage, UploadLimitMiddleware, VARIANTS, VARIANT_TYPE,
+    shutdown as shutdown_image_pool,
+)
+import json
 import base64
-from external.payment import get_payment_url
-import random
+import asyncio
+import logging
+from decimal import Decimal
+from typing import Literal
+from contextlib import asynccontextmanager
 origins = [
     "http://localhost:3000",
 ]
-app = FastAPI()
-load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _check_schema()
+    await _sync_revocations()
+    await _warm_up()
+    background_tasks = [
+        asyncio.create_task(_revocation_refresh_loop()),
+        asyncio.create_task(_inventory_flush_loop()),
+        asyncio.create_task(outbox.run()),
+    ]
+    if TOKEN_PRUNE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(_token_prune_loop()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await _flush_inventory(force=True)
+    await payment_client.aclose()
+    shutdown_executor()
+    shutdown_image_pool()
+    shutdown_password_pool()
+
+admission = create_admission()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware, paths=["/products/", "/products/edit/{product_id}", "/products/{product_id}"])
+# Added before CORS so it runs inside it and 429/503 answers keep their CORS headers
+app.add_middleware(AdmissionMiddleware, admission=admission, subject=lambda token: _token_subject(token))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -25,14 +92,49 @@ app.add_middleware(
     allow_headers=["*"]
 
 )
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 SECRET_KEY = os.getenv("SECRET_KEY")
-db_config = {
-    "host": os.getenv("DB_URL"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "database": os.getenv("DB_NAME"),
-    "port": os.getenv("DB_PORT")
-}
+db_config = config_from_env()
+db_pool = create_pool(db_config)
+revocation_list = RevocationList()
+order_numbers = create_allocator(lambda: get_db_connection())
+inventory = create_inventory(db_config)
+payment_client = create_payment_client()
+log_notifier = LogNotifier()
+catalog_version = create_catalog_version(lambda: get_db_connection())
+STREAM_RECHECK_SECONDS = float(os.getenv("STREAM_RECHECK_SECONDS", "2"))
+INVENTORY_FLUSH_SECONDS = float(os.getenv("INVENTORY_FLUSH_SECONDS", "5"))
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+TOKEN_PRUNE_INTERVAL = float(os.getenv("TOKEN_PRUNE_INTERVAL", "3600"))
+# verify_token never reads the Token table, it is kept only as a login audit
+STORE_LOGIN_TOKENS = env_bool("STORE_LOGIN_TOKENS", True)
+token_pruner = create_pruner(db_config)
+SCHEMA_AUTO_MIGRATE = env_bool("SCHEMA_AUTO_MIGRATE", False)
+SCHEMA_EXPLAIN_CHECK = env_bool("SCHEMA_EXPLAIN_CHECK", True)
+WARM_UP = env_bool("WARM_UP", True)
+WARM_DB_CONNECTIONS = int(os.getenv("WARM_DB_CONNECTIONS", os.getenv("DB_POOL_SIZE", "5")))
+READY_CHECK_TIMEOUT = float(os.getenv("READY_CHECK_TIMEOUT", "2"))
+startup = {"pid": os.getpid(), "ready": False, "import_seconds": None, "warm_up_seconds": None, "ready_seconds": None}
+product_cache = TTLCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60")),
+    enabled=env_bool("PRODUCT_CACHE_ENABLED", True),
+)
+# Rendered (and compressed) catalog bodies, keyed by catalog version
+response_cache = TTLCache(
+    maxsize=int(os.getenv("CATALOG_RESPONSE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("CATALOG_RESPONSE_CACHE_TTL", "300")),
+    enabled=env_bool("CATALOG_RESPONSE_CACHE_ENABLED", True),
+)
+# Carts keyed by (owner, ShoppingCart.version, catalog token): a write in any
+# worker bumps the version and a product edit the catalog, so no entry is
+# ever invalidated by hand, old ones just age out.
+cart_cache = TTLCache(
+    maxsize=int(os.getenv("CART_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("CART_CACHE_TTL", "30")),
+    enabled=env_bool("CART_CACHE_ENABLED", True),
+)
 
 class Customer(BaseModel):
     userName: str
@@ -86,19 +188,58 @@ class ShoppingCartItemResponse(BaseModel):
     name: str
     quantity: int
     price: float
+    line_total: float
+
+class ShoppingCartResponse(BaseModel):
+    cartId: int
+    items: list[ShoppingCartItemResponse]
+    item_count: int
+    total_amount: float
+
+class CartItemChange(BaseModel):
+    product_id: int
+    quantity: int = 0
+    op: Literal["add", "set", "remove"] = "add"
     
 def get_db_connection():
-    return mysql.connector.connect(**db_config)
+    return db_pool.connection()
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Database is busy, try again later"})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(PaymentError)
+async def payment_error_handler(request, exc):
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
+@app.exception_handler(ImageTooLarge)
+async def image_too_large_handler(request, exc):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+@app.exception_handler(OrderNumbersExhausted)
+async def order_numbers_exhausted_handler(request, exc):
+    logger.error("%s", exc)
+    return JSONResponse(status_code=503, content={"detail": "Orders cannot be placed right now"})
+
+@app.exception_handler(UnsupportedImage)
+async def unsupported_image_handler(request, exc):
+    return JSONResponse(status_code=415, content={"detail": str(exc)})
 
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=30)):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + expires_delta
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
     return encoded_jwt, expire
 
 async def get_current_user(x_token: str = Header(...)):
     payload = verify_token(x_token)
+    if revocation_list.is_revoked(token_id(x_token, payload)):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
     return payload
 
 def verify_token(token: str):
@@ -110,63 +251,208 @@ def verify_token(token: str):
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-def is_token_blacklisted(token: str):
+STATS_TOKEN = os.getenv("STATS_TOKEN")
+
+def require_stats_token(authorization: str = Header(None)):
+    # /stats/* and /metrics show internals, so they want STATS_TOKEN as a
+    # bearer token and stay closed while it is not set.
+    scheme, _, token = (authorization or "").partition(" ")
+    if not STATS_TOKEN or scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), STATS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+def _token_subject(token: str):
+    # Rate limit key only; get_current_user still does the full check
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("sub")
+    except jwt.InvalidTokenError:
+        return None
+
+def is_token_blacklisted(token: str, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    blacklisted = repository.token_blacklisted(conn, token)
+    if own_conn:
+        conn.close()
+    return blacklisted
+
+def _fetch_blacklist_rows(after_id, limit):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM TokenBlacklist WHERE token = %s", (token))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return result is not None
+    try:
+        return repository.blacklist_page(conn, after_id, limit)
+    finally:
+        conn.close()
 
+def _migrate_or_report():
+    conn = get_db_connection()
+    try:
+        if SCHEMA_AUTO_MIGRATE:
+            applied = migrate(conn)
+            if applied:
+                logger.info("Applied schema versions %s", applied)
+            return
+        todo = pending_migrations(conn)
+    finally:
+        conn.close()
+    if todo:
+        logger.warning(
+            "Database schema is missing versions %s (latest is %s), run python -m internal.schema",
+            [version for version, _ in todo], LATEST_VERSION
+        )
 
-@app.post("/customers/")
-def create_customer(customer: Customer):
-    hashed_password = bcrypt.hashpw(customer.password.encode('utf-8'), bcrypt.gensalt())
-    customer_uuid = str(uuid.uuid4())
+async def _check_schema():
+    # Never stops startup: a database we cannot inspect is reported and the
+    # handlers fail on their own if it is really unusable.
+    try:
+        await run_blocking(_migrate_or_report)
+        if SCHEMA_EXPLAIN_CHECK:
+            await run_blocking(repository.check_query_plans, get_db_connection)
+    except Exception:
+        logger.exception("Checking the database schema failed")
+
+async def _warm_up_step(name, func, *args):
+    try:
+        await func(*args)
+    except Exception:
+        logger.exception("Warm-up step %s failed", name)
+
+async def _warm_up():
+    # Each worker opens its DB connections, renders the first catalog page
+    # and starts the bcrypt processes before /health/ready says yes, so a
+    # worker that joins the load balancer is already fast.
+    started = time.perf_counter()
+    if WARM_UP:
+        await _warm_up_step("db connections", run_blocking, db_pool.warm, WARM_DB_CONNECTIONS)
+        await _warm_up_step("catalog", run_blocking, _warm_catalog)
+        await _warm_up_step("password hashing", warm_up_passwords)
+    startup["warm_up_seconds"] = round(time.perf_counter() - started, 3)
+    startup["ready_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    startup["ready"] = True
+    logger.info(
+        "Worker %s ready in %.2fs (imports %.2fs, warm-up %.2fs)",
+        startup["pid"], startup["ready_seconds"], startup["import_seconds"], startup["warm_up_seconds"]
+    )
+
+def _warm_catalog():
+    token, _ = catalog_version.current()
+    for encoding in (None, *supported_encodings()):
+        _rendered_body(token, ("allproducts", 0, 50), lambda token: _product_page(0, 50), encoding)
+
+_ready_conn = None
+_ready_lock = threading.Lock()
+
+def _ping_db():
+    # A connection of its own, outside the pool and the run_blocking threads:
+    # a saturated pool means load, not a dead database, and must not take
+    # the worker out of the load balancer.
+    global _ready_conn
+    if not _ready_lock.acquire(timeout=READY_CHECK_TIMEOUT):
+        raise TimeoutError("previous readiness check still running")
+    try:
+        if _ready_conn is None:
+            _ready_conn = mysql.connector.connect(**db_config, connection_timeout=max(int(READY_CHECK_TIMEOUT), 1))
+        _ready_conn.ping(reconnect=True, attempts=1, delay=0)
+    finally:
+        _ready_lock.release()
+
+async def _sync_revocations():
+    try:
+        await run_blocking(revocation_list.refresh, _fetch_blacklist_rows)
+    except Exception:
+        logger.exception("Refreshing the token revocation list failed")
+
+async def _flush_inventory(force=False):
+    try:
+        await run_blocking(inventory.flush, force)
+    except Exception:
+        logger.exception("Returning leased inventory failed")
+
+async def _inventory_flush_loop():
+    # Hands expired reservations and idle leases back to MySQL in batches.
+    while True:
+        await asyncio.sleep(INVENTORY_FLUSH_SECONDS)
+        await _flush_inventory()
+
+async def _token_prune_loop():
+    while True:
+        await asyncio.sleep(TOKEN_PRUNE_INTERVAL)
+        try:
+            await run_blocking(token_pruner.run)
+        except Exception:
+            logger.exception("Pruning expired tokens failed")
+
+async def _revocation_refresh_loop():
+    # Picks up logouts made on other workers; local logouts apply immediately.
+    while True:
+        await asyncio.sleep(REVOCATION_REFRESH_SECONDS)
+        await _sync_revocations()
+
+
+def _insert_customer(customer_uuid, customer: Customer, hashed_password):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Customer (uuid, userName, email, password) VALUES (%s, %s, %s, %s)",
-        (customer_uuid, customer.userName, customer.email, hashed_password.decode('utf-8'))
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute(
+            "INSERT INTO Customer (uuid, userName, email, password) VALUES (%s, %s, %s, %s)",
+            (customer_uuid, customer.userName, customer.email, hashed_password)
+        )
+        conn.commit()
+    except mysql.connector.IntegrityError:
+        # uq_customer_email
+        conn.rollback()
+        raise HTTPException(status_code=409, detail="Email is already registered")
+    finally:
+        cursor.close()
+        conn.close()
+
+@app.post("/customers/")
+async def create_customer(customer: Customer):
+    hashed_password = await hash_password(customer.password)
+    customer_uuid = str(uuid.uuid4())
+    await run_blocking(_insert_customer, customer_uuid, customer, hashed_password)
     return {"message": "Customer created", "uuid": customer_uuid}
 
-@app.post("/login", response_model=TokenResponse)
-def login(login_request: LoginRequest):
+def _find_login(email):
+    conn = get_db_connection()
+    try:
+        return repository.find_login(conn, email)
+    finally:
+        conn.close()
+
+def _record_login(user_uuid, access_token, expire, rehashed_password):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT uuid, password FROM Customer WHERE email = %s", (login_request.email,))
-    customer = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    
-    if customer and bcrypt.checkpw(login_request.password.encode('utf-8'), customer[1].encode('utf-8')):
-        access_token, expire = create_access_token(data={"sub": customer[0]})
-        
+    try:
         # Store the token in the Token table
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO Token (token, user_uuid, expiration_time) VALUES (%s, %s, %s)",
-            (access_token, customer[0], expire)
-        )
+        if STORE_LOGIN_TOKENS:
+            cursor.execute(
+                "INSERT INTO Token (token, user_uuid, expiration_time) VALUES (%s, %s, %s)",
+                (access_token, user_uuid, expire)
+            )
+        if rehashed_password:
+            cursor.execute("UPDATE Customer SET password = %s WHERE uuid = %s", (rehashed_password, user_uuid))
         conn.commit()
+    finally:
         cursor.close()
         conn.close()
-        
-        return {"access_token": access_token, "token_type": "bearer"}
-    else:
+
+@app.post("/login", response_model=TokenResponse)
+async def login(login_request: LoginRequest):
+    customer = await run_blocking(_find_login, login_request.email)
+
+    if not customer or not await verify_password(login_request.password, customer[1]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-@app.put("/customer/{user_uuid}/edit", dependencies=[Depends(get_current_user)])
-async def edit_customer(user_uuid: str, customer_edit: CustomerEditRequest, current_user: dict = Depends(get_current_user)):
-    if current_user["sub"] != user_uuid:
-        raise HTTPException(status_code=403, detail="You do not have permission to edit this user")
+    # Hashes made with an older BCRYPT_ROUNDS are upgraded while we still have the password.
+    rehashed_password = await hash_password(login_request.password) if needs_rehash(customer[1]) else None
 
+    access_token, expire = create_access_token(data={"sub": customer[0]})
+    if STORE_LOGIN_TOKENS or rehashed_password:
+        await run_blocking(_record_login, customer[0], access_token, expire, rehashed_password)
+
+    return {"access_token": access_token, "token_type": "bearer"}
+
+def _update_customer(user_uuid: str, customer_edit: CustomerEditRequest):
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -196,6 +482,9 @@ async def edit_customer(user_uuid: str, customer_edit: CustomerEditRequest, curr
             cursor.execute(update_query, tuple(update_values))
             conn.commit()
 
+    except mysql.connector.IntegrityError:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail="Email is already registered")
     except mysql.connector.Error as err:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {err}")
@@ -203,22 +492,34 @@ async def edit_customer(user_uuid: str, customer_edit: CustomerEditRequest, curr
         cursor.close()
         conn.close()
 
+@app.put("/customer/{user_uuid}/edit", dependencies=[Depends(get_current_user)])
+async def edit_customer(user_uuid: str, customer_edit: CustomerEditRequest, current_user: dict = Depends(get_current_user)):
+    if current_user["sub"] != user_uuid:
+        raise HTTPException(status_code=403, detail="You do not have permission to edit this user")
+
+    await run_blocking(_update_customer, user_uuid, customer_edit)
     return {"message": "Customer information updated successfully"}
 
-@app.post("/logout", dependencies=[Depends(get_current_user)])
-async def logout(x_token: str = Header(...), current_user: dict = Depends(get_current_user)):
-    if is_token_blacklisted(x_token):
-        raise HTTPException(status_code=401, detail="Token is already busted")
-    
+def _blacklist_token(token: str, user_uuid: str, exp=None):
     conn = get_db_connection()
+    if is_token_blacklisted(token, conn):
+        conn.close()
+        raise HTTPException(status_code=401, detail="Token is already busted")
+
     cursor = conn.cursor()
+    # expires_at lets the pruner drop the row once the token is dead anyway
     cursor.execute(
-        "INSERT INTO TokenBlacklist (token, uuid) VALUES (%s, %s)",
-        (x_token, current_user["sub"])
+        "INSERT INTO TokenBlacklist (token, uuid, expires_at) VALUES (%s, %s, %s)",
+        (token, user_uuid, datetime.fromtimestamp(exp, timezone.utc) if exp else None)
     )
     conn.commit()
     cursor.close()
     conn.close()
+
+@app.post("/logout", dependencies=[Depends(get_current_user)])
+async def logout(x_token: str = Header(...), current_user: dict = Depends(get_current_user)):
+    await run_blocking(_blacklist_token, x_token, current_user["sub"], current_user.get("exp"))
+    revocation_list.revoke(token_id(x_token, current_user), current_user.get("exp"))
     return {"message": "Successfully logged out"}
    
 @app.get("/customers/{customer_uuid}", dependencies=[Depends(get_current_user)])
@@ -235,6 +536,63 @@ def get_customer(customer_uuid: str):
         raise HTTPException(status_code=404, detail="Customer not found")
 
 
+STREAM_FETCH_SIZE = 500
+LISTING_VARIANT = "small"
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Unversioned or outdated image URLs are revalidated against the ETag instead
+IMAGE_REVALIDATE = "public, no-cache"
+
+def product_image_url(product_id, content_hash=None, variant=None):
+    # The hash prefix of the original versions the URL (variants are derived
+    # from it), so the image can be cached forever.
+    params = []
+    if variant:
+        params.append(f"variant={variant}")
+    if content_hash:
+        params.append(f"v={content_hash[:16]}")
+    query = "?" + "&".join(params) if params else ""
+    return f"/products/{product_id}/image{query}"
+
+def _product_summary(row, variant=None):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "description": row[2],
+        "price": row[3],
+        "availableItem": row[4],
+        "categoryId": row[5],
+        "owner": {
+            "uuid": row[6]
+        },
+        "image_url": product_image_url(row[0], row[8], variant) if row[7] else None,
+        "image_hash": row[8] if row[7] else None
+    }
+
+def _image_metadata(image_data):
+    return image_hash(image_data), detect_image_type(image_data) or "application/octet-stream", len(image_data)
+
+def _replace_image_variants(cursor, product_id, variants):
+    cursor.execute("DELETE FROM ProductImageVariant WHERE product_id = %s", (product_id,))
+    cursor.executemany(
+        "INSERT INTO ProductImageVariant (product_id, variant, image, image_hash, image_type, image_size) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        [(product_id, name, data, image_hash(data), VARIANT_TYPE, len(data)) for name, data in variants]
+    )
+
+def _insert_product(name, description, price, image_data, variants, owner_uuid):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO Product (name, description, price, image, image_hash, image_type, image_size, owner_uuid) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+        (name, description, price, image_data, *_image_metadata(image_data), owner_uuid)
+    )
+    _replace_image_variants(cursor, cursor.lastrowid, variants)
+    catalog_version.bump(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
 @app.post("/products/", dependencies=[Depends(get_current_user)])
 async def create_product(
     name: str = Form(...),
@@ -243,44 +601,211 @@ async def create_product(
     image: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    image_data = await image.read()
+    image_data = await read_upload(image)
+    variants = await render_variants(image_data)
     owner_uuid = current_user["sub"]
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Product (name, description, price, image, owner_uuid) VALUES (%s, %s, %s, %s, %s)",
-        (name, description, price, image_data, owner_uuid)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    await run_blocking(_insert_product, name, description, price, image_data, variants, owner_uuid)
+    catalog_version.invalidate()
     return {"message": "Product created"}
 
-@app.get("/products/{product_id}", dependencies=[Depends(get_current_user)])
-def get_product(product_id: int, current_user: dict = Depends(get_current_user)):
+SEARCH_MAX_OFFSET = 1000
+
+def _search_products(q, categories, min_price, max_price, in_stock, limit, offset):
+    filters, params = [], []
+    score = "0"
+    if q:
+        # Served by the FULLTEXT (name, description) index, ranked by relevance
+        score = "MATCH(name, description) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        filters.append(score)
+        params.append(q)
+    if min_price is not None:
+        filters.append("price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        filters.append("price <= %s")
+        params.append(max_price)
+    if in_stock:
+        filters.append("availableItemCount > 0")
+    if categories:
+        filters.append(
+            "EXISTS (SELECT 1 FROM ProductCategoryMapping m WHERE m.product_id = Product.id "
+            f"AND m.category_id IN ({', '.join(['%s'] * len(categories))}))"
+        )
+        params.extend(categories)
+
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    query = (
+        f"SELECT {PRODUCT_SUMMARY_COLUMNS}, {score} AS score FROM Product {where} "
+        "ORDER BY score DESC, id DESC LIMIT %s OFFSET %s"
+    )
+    score_params = [q] if q else []
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name, description, price, availableItemCount, categoryId, owner_uuid, image FROM Product WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
+    cursor.execute(query, tuple(score_params + params + [limit, offset]))
+    rows = cursor.fetchall()
     cursor.close()
     conn.close()
-    if product:
-        return {
-            "id": product[0],
-            "name": product[1],
-            "description": product[2],
-            "price": product[3],
-            "availableItem": product[4],
-            "categoryId": product[5],
-            "owner": {
-                "uuid": product[6]
-            },
-            "image": base64.b64encode(product[7]).decode('utf-8') if product[7] else None
-        }
-    else:
+    return rows
+
+@app.get("/products/search")
+async def search_products(
+    q: str = Query(None, min_length=2, max_length=100),
+    category: list[int] = Query(None),
+    min_price: float = Query(None, ge=0),
+    max_price: float = Query(None, ge=0),
+    in_stock: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET)
+):
+    rows = await run_blocking(_search_products, q, category, min_price, max_price, in_stock, limit, offset)
+    items = []
+    for row in rows:
+        product = _product_summary(row, LISTING_VARIANT)
+        product["score"] = float(row[9])
+        items.append(product)
+    next_offset = offset + limit if len(items) == limit and offset + limit <= SEARCH_MAX_OFFSET else None
+    return {"items": items, "next_offset": next_offset}
+
+def _load_product(product_id):
+    conn = get_db_connection()
+    try:
+        product = repository.product_by_id(conn, product_id)
+    finally:
+        conn.close()
+    return _product_summary(product) if product else None
+
+def _rendered_body(token, key, load, encoding):
+    def render():
+        payload = load(token)
+        if payload is None:
+            return None
+        body = json.dumps(payload, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return compress(body, encoding)
+
+    return response_cache.get_or_load((token, *key, encoding), render)
+
+def _catalog_response(request, key, load, cache_control):
+    # Weak validators come from the catalog version; a matching client gets
+    # 304 without a database read, everyone else a body rendered and
+    # compressed once per version and encoding.
+    token, last_modified = catalog_version.current()
+    etag = f'W/"{token}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    rendered = _rendered_body(token, key, load, choose_encoding(request.headers.get("accept-encoding")))
+    if rendered is None:
+        return None
+    body, content_encoding = rendered
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/products/{product_id}", dependencies=[Depends(get_current_user)])
+def get_product(product_id: int, request: Request, current_user: dict = Depends(get_current_user)):
+    # Cached products are keyed by catalog version too, so an edit made on
+    # any worker retires them. The product is resolved before the validators
+    # are compared, or a missing one would answer 304 to a matching ETag.
+    def load(token):
+        return product_cache.get_or_load((token, product_id), lambda: _load_product(product_id))
+
+    token, _ = catalog_version.current()
+    if load(token) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    response = _catalog_response(request, ("product", product_id), load, "private, no-cache")
+    if response is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    return response
     
     
+def _parse_category_ids(categoryIds):
+    # Form fields arrive as None when they are empty, so clearing every
+    # category needs a value of its own: "none".
+    if categoryIds is None:
+        return None
+    if categoryIds.strip().lower() == "none":
+        return []
+    try:
+        return sorted({int(cid) for cid in categoryIds.split(',') if cid.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid category ID format")
+
+def _apply_category_diff(cursor, product_id, category_ids):
+    # Only the mappings that actually change are touched: one DELETE for the
+    # removed ones and one multi-row INSERT for the added ones.
+    cursor.execute("SELECT category_id FROM ProductCategoryMapping WHERE product_id = %s", (product_id,))
+    current = {row[0] for row in cursor.fetchall()}
+    wanted = set(category_ids)
+    removed = sorted(current - wanted)
+    added = sorted(wanted - current)
+    if removed:
+        cursor.execute(
+            f"DELETE FROM ProductCategoryMapping WHERE product_id = %s "
+            f"AND category_id IN ({', '.join(['%s'] * len(removed))})",
+            (product_id, *removed)
+        )
+    if added:
+        cursor.executemany(
+            "INSERT INTO ProductCategoryMapping (product_id, category_id) VALUES (%s, %s)",
+            [(product_id, category_id) for category_id in added]
+        )
+
+def _ensure_owner(product, owner_uuid):
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if product[0] != owner_uuid:
+        raise HTTPException(status_code=403, detail="You do not have permission to edit this product")
+
+def _check_owner(product_id, owner_uuid):
+    # Cheap early check so nobody gets images rendered for a product they
+    # cannot edit; _write_product checks again under the row lock.
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT owner_uuid FROM Product WHERE id = %s", (product_id,))
+        _ensure_owner(cursor.fetchone(), owner_uuid)
+    finally:
+        cursor.close()
+        conn.close()
+
+def _write_product(product_id, owner_uuid, fields, category_ids=None, image_data=None, variants=None):
+    # Ownership check and every write happen in one transaction; the row lock
+    # from FOR UPDATE keeps a concurrent edit from interleaving.
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT owner_uuid FROM Product WHERE id = %s FOR UPDATE", (product_id,))
+        _ensure_owner(cursor.fetchone(), owner_uuid)
+
+        fields = dict(fields)
+        if image_data is not None:
+            fields["image"] = image_data
+            fields["image_hash"], fields["image_type"], fields["image_size"] = _image_metadata(image_data)
+        if fields:
+            cursor.execute(
+                f"UPDATE Product SET {', '.join(f'{column} = %s' for column in fields)} WHERE id = %s",
+                (*fields.values(), product_id)
+            )
+        if variants is not None:
+            _replace_image_variants(cursor, product_id, variants)
+
+        # Update product-category mappings
+        if category_ids is not None:
+            _apply_category_diff(cursor, product_id, category_ids)
+
+        catalog_version.bump(cursor)
+        conn.commit()
+    except mysql.connector.Error as err:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {err}")
+    finally:
+        cursor.close()
+        conn.close()
+
 @app.put("/products/edit/{product_id}", dependencies=[Depends(get_current_user)])
 async def edit_product(
     product_id: int,
@@ -292,184 +817,396 @@ async def edit_product(
     image: UploadFile = File(...),
     current_user: dict = Depends(get_current_user)
 ):
-    image_data = await image.read()
-    owner_uuid = current_user["sub"]
-    
+    category_ids = _parse_category_ids(categoryIds)
+    await run_blocking(_check_owner, product_id, current_user["sub"])
+    image_data = await read_upload(image)
+    variants = await render_variants(image_data)
+    fields = {"name": name, "description": description, "price": price, "availableItemCount": availableItem}
+    await run_blocking(_write_product, product_id, current_user["sub"], fields, category_ids, image_data, variants)
+    catalog_version.invalidate()
+    return {"message": "Product updated successfully"}
+
+@app.patch("/products/{product_id}", dependencies=[Depends(get_current_user)])
+async def patch_product(
+    product_id: int,
+    name: str = Form(None),
+    description: str = Form(None),
+    price: float = Form(None),
+    availableItem: int = Form(None),
+    categoryIds: str = Form(None),  # comma-separated; send "none" to clear
+    image: UploadFile = File(None),
+    current_user: dict = Depends(get_current_user)
+):
+    # Only the submitted fields are written; the image BLOB and the category
+    # mappings are left alone unless they are part of the request.
+    category_ids = _parse_category_ids(categoryIds)
+    fields = {
+        column: value for column, value in (
+            ("name", name), ("description", description), ("price", price), ("availableItemCount", availableItem)
+        ) if value is not None
+    }
+    image_data = variants = None
+    if image is not None:
+        await run_blocking(_check_owner, product_id, current_user["sub"])
+        image_data = await read_upload(image)
+        variants = await render_variants(image_data)
+    if not fields and category_ids is None and image_data is None:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+
+    await run_blocking(_write_product, product_id, current_user["sub"], fields, category_ids, image_data, variants)
+    catalog_version.invalidate()
+    return {"message": "Product updated successfully"}
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _fetch_product_page(after_id, limit):
+    conn = get_db_connection()
+    try:
+        return repository.product_page(conn, after_id, limit)
+    finally:
+        conn.close()
+
+def _stream_products(after_id, fmt):
+    # Rows are written as they come off an unbuffered cursor, so exporting the
+    # whole catalog never holds more than one fetch batch in memory.
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    cursor.execute("SELECT owner_uuid FROM Product WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
-    if not product:
+    try:
+        cursor.execute(
+            f"SELECT {PRODUCT_SUMMARY_COLUMNS} FROM Product WHERE id > %s ORDER BY id",
+            (after_id,)
+        )
+        first = True
+        if fmt == "json":
+            yield "["
+        while True:
+            rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                line = json.dumps(_product_summary(row, LISTING_VARIANT), default=_json_default)
+                if fmt == "ndjson":
+                    yield line + "\n"
+                else:
+                    yield line if first else "," + line
+                first = False
+        if fmt == "json":
+            yield "]"
+    finally:
+        if conn.unread_result:
+            conn.consume_results()
         cursor.close()
         conn.close()
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    if product[0] != owner_uuid:
+
+def _fetch_image_metadata(product_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT image IS NOT NULL, image_hash, image_type, image_size FROM Product WHERE id = %s",
+            (product_id,)
+        )
+        product = cursor.fetchone()
+        if not product or not product[0]:
+            return None
+        if product[1] is None:
+            # Rows written before image_hash existed are backfilled on first view.
+            cursor.execute("SELECT image FROM Product WHERE id = %s", (product_id,))
+            metadata = _image_metadata(bytes(cursor.fetchone()[0]))
+            cursor.execute(
+                "UPDATE Product SET image_hash = %s, image_type = %s, image_size = %s WHERE id = %s",
+                (*metadata, product_id)
+            )
+            catalog_version.bump(cursor)
+            conn.commit()
+            catalog_version.invalidate()
+            return metadata
+        return product[1], product[2], product[3]
+    finally:
         cursor.close()
         conn.close()
-        raise HTTPException(status_code=403, detail="You do not have permission to edit this product")
-    
+
+def _fetch_variant_metadata(product_id, variant):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # The original's hash comes along: it is what versions the image URL
     cursor.execute(
-        "UPDATE Product SET name = %s, description = %s, price = %s, availableItemCount = %s, image = %s WHERE id = %s",
-        (name, description, price, availableItem, image_data, product_id)
+        "SELECT v.image_hash, v.image_type, v.image_size, p.image_hash FROM ProductImageVariant v "
+        "JOIN Product p ON p.id = v.product_id WHERE v.product_id = %s AND v.variant = %s",
+        (product_id, variant)
     )
-    
-    # Update product-category mappings
-    cursor.execute("DELETE FROM ProductCategoryMapping WHERE product_id = %s", (product_id,))
-    try:
-        category_ids = [int(cid) for cid in categoryIds.split(',')]
-    except ValueError:
-        cursor.close()
-        conn.close()
-        raise HTTPException(status_code=400, detail="Invalid category ID format")
-    
-    for category_id in category_ids:
-        cursor.execute(
-            "INSERT INTO ProductCategoryMapping (product_id, category_id) VALUES (%s, %s)",
-            (product_id, category_id)
-        )
-    
-    conn.commit()
+    metadata = cursor.fetchone()
     cursor.close()
     conn.close()
-    return {"message": "Product updated successfully"}
+    return metadata
 
-@app.get("/allproducts")
-def get_all_products():
+def _fetch_image_bytes(product_id, offset, length, variant=None):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Product")
-    products = cursor.fetchall()
+    if variant:
+        cursor.execute(
+            "SELECT SUBSTRING(image, %s, %s) FROM ProductImageVariant WHERE product_id = %s AND variant = %s",
+            (offset + 1, length, product_id, variant)
+        )
+    else:
+        cursor.execute("SELECT SUBSTRING(image, %s, %s) FROM Product WHERE id = %s", (offset + 1, length, product_id))
+    product = cursor.fetchone()
     cursor.close()
     conn.close()
-    
-    product_list = []
-    for product in products:
-        product_list.append({
-            "id": product[0],
-            "name": product[1],
-            "description": product[2],
-            "price": product[3],
-            "availableItem": product[4],
-            "categoryId": product[5],
-            "owner": {
-                "uuid": product[6]
-            },
-            "image": base64.b64encode(product[7]).decode('utf-8') if product[7] else None
-        })
-    
-    return product_list
+    return bytes(product[0]) if product and product[0] is not None else b""
+
+@app.get("/products/{product_id}/image")
+def get_product_image(product_id: int, request: Request, variant: str = Query(None)):
+    if variant is not None and variant not in VARIANTS:
+        raise HTTPException(status_code=400, detail=f"variant must be one of: {', '.join(VARIANTS)}")
+
+    metadata = _fetch_variant_metadata(product_id, variant) if variant else None
+    if metadata:
+        *metadata, original_hash = metadata
+    else:
+        # Products uploaded before variants existed fall back to the original.
+        variant = None
+        metadata = _fetch_image_metadata(product_id)
+        if not metadata:
+            raise HTTPException(status_code=404, detail="Image not found")
+        original_hash = metadata[0]
+    content_hash, content_type, size = metadata
+
+    # Only the URL product_image_url() hands out for this very image may be
+    # cached for good; anything else would keep an old image after a re-upload.
+    version = request.query_params.get("v")
+    current = bool(version) and original_hash is not None and original_hash[:16] == version
+    etag = f'"{content_hash}"'
+    headers = {
+        "ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL if current else IMAGE_REVALIDATE, "Accept-Ranges": "bytes",
+    }
+
+    if not_modified(request.headers, etag, None):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            first, last = byte_range
+            body = _fetch_image_bytes(product_id, first, last - first + 1, variant)
+            headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+            return Response(content=body, status_code=206, media_type=content_type, headers=headers)
+
+    body = _fetch_image_bytes(product_id, 0, size, variant)
+    return Response(content=body, media_type=content_type, headers=headers)
+
+def _product_page(after_id, limit):
+    products = _fetch_product_page(after_id, limit)
+    product_list = [_product_summary(product, LISTING_VARIANT) for product in products]
+    return {
+        "items": product_list,
+        "next_after_id": product_list[-1]["id"] if len(product_list) == limit else None
+    }
+
+@app.get("/allproducts")
+def get_all_products(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    after_id: int = Query(0, ge=0),
+    stream: str = Query(None, pattern="^(json|ndjson)$")
+):
+    if stream:
+        media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingResponse(_stream_products(after_id, stream), media_type=media_type)
+
+    return _catalog_response(
+        request, ("allproducts", after_id, limit), lambda token: _product_page(after_id, limit), "public, no-cache"
+    )
 
 # Order endpoints
+def _read_cart(conn, user_uuid):
+    rows = repository.read_cart(conn, user_uuid)
+    if not rows:
+        return None
+
+    items = []
+    for row in rows:
+        if row['product_id'] is None or row['name'] is None:
+            continue
+        price = money(row['price'])
+        items.append({
+            "product_id": row['product_id'],
+            "name": row['name'],
+            "quantity": row['quantity'],
+            "price": price,
+            "line_total": money(price * row['quantity'])
+        })
+    return {
+        "cartId": rows[0]['cartId'],
+        "items": items,
+        "item_count": sum(item['quantity'] for item in items),
+        "total_amount": money(sum((item['line_total'] for item in items), Decimal("0")))
+    }
+
+def _add_cart_item(user_uuid, product_id, quantity):
+    conn = get_db_connection()
+    try:
+        cart_id = repository.cart_id(conn, user_uuid)
+
+        # Add item to the cart, only while the product still has that much stock.
+        # This is a soft check; stock is actually taken at checkout.
+        added = repository.add_cart_item(conn, cart_id, product_id, quantity)
+        conn.commit()
+    finally:
+        conn.close()
+    if not added:
+        raise HTTPException(status_code=409, detail="Product not found or not enough stock")
+
 @app.post("/cart/add", dependencies=[Depends(get_current_user)])
 async def add_to_cart(
     product_id: int = Form(...),
-    quantity: int = Form(...),
+    quantity: int = Form(..., ge=1),
     current_user: dict = Depends(get_current_user)
 ):
-    user_uuid = current_user["sub"]
+    await run_blocking(_add_cart_item, current_user["sub"], product_id, quantity)
+    return {"message": "Item added to cart"}
+
+def _validate_cart_changes(changes):
+    seen = set()
+    for change in changes:
+        if change.product_id in seen:
+            raise HTTPException(status_code=400, detail=f"Product {change.product_id} appears more than once")
+        seen.add(change.product_id)
+        if change.op == "add" and change.quantity < 1:
+            raise HTTPException(status_code=400, detail=f"Quantity for product {change.product_id} must be at least 1")
+        if change.op == "set" and change.quantity < 0:
+            raise HTTPException(status_code=400, detail=f"Quantity for product {change.product_id} cannot be negative")
+
+def _apply_cart_changes(user_uuid, changes):
+    # Every change lands in one transaction: either the whole batch is
+    # applied or, if any product is missing or short on stock, none of it.
+    removes = [change.product_id for change in changes if change.op == "remove" or (change.op == "set" and change.quantity == 0)]
+    upserts = [change for change in changes if change.product_id not in removes]
 
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cart_id = repository.cart_id(conn, user_uuid)
+
+        if upserts:
+            # Same soft stock check as /cart/add, done for the whole batch at once
+            ids = [change.product_id for change in upserts]
+            cursor.execute(
+                f"SELECT p.id, p.availableItemCount + {LEASED_STOCK} AS availableItemCount FROM Product p "
+                f"WHERE p.id IN ({', '.join(['%s'] * len(ids))})",
+                ids
+            )
+            stock = {row['id']: row['availableItemCount'] for row in cursor.fetchall()}
+            rejected = [change.product_id for change in upserts if stock.get(change.product_id, 0) < change.quantity]
+            if rejected:
+                raise HTTPException(status_code=409, detail={"message": "Product not found or not enough stock", "product_ids": rejected})
 
-    # Check if the user already has a cart
-    cursor.execute("SELECT cartId FROM ShoppingCart WHERE owner = %s", (user_uuid,))
-    cart = cursor.fetchone()
+        if removes:
+            cursor.execute(
+                f"DELETE FROM ShoppingCartItem WHERE cartId = %s AND productId IN ({', '.join(['%s'] * len(removes))})",
+                (cart_id, *removes)
+            )
+        adds = [(cart_id, change.product_id, change.quantity) for change in upserts if change.op == "add"]
+        if adds:
+            cursor.executemany(
+                "INSERT INTO ShoppingCartItem (cartId, productId, quantity) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)",
+                adds
+            )
+        sets = [(cart_id, change.product_id, change.quantity) for change in upserts if change.op == "set"]
+        if sets:
+            cursor.executemany(
+                "INSERT INTO ShoppingCartItem (cartId, productId, quantity) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE quantity = VALUES(quantity)",
+                sets
+            )
 
-    if not cart:
-        # Create a new cart for the user
-        cursor.execute("INSERT INTO ShoppingCart (owner) VALUES (%s)", (user_uuid,))
+        cart = _read_cart(conn, user_uuid)
         conn.commit()
-        cart_id = cursor.lastrowid
-    else:
-        cart_id = cart[0]
+    except mysql.connector.Error as err:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {err}")
+    finally:
+        cursor.close()
+        conn.close()
+    return cart
 
-    # Add item to the cart
-    cursor.execute(
-        "INSERT INTO ShoppingCartItem (cartId, productId, quantity) VALUES (%s, %s, %s) "
-        "ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)",
-        (cart_id, product_id, quantity)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return {"message": "Item added to cart"}
+@app.post("/cart/items", response_model=ShoppingCartResponse, dependencies=[Depends(get_current_user)])
+async def update_cart_items(changes: list[CartItemChange], current_user: dict = Depends(get_current_user)):
+    if not changes:
+        raise HTTPException(status_code=400, detail="No cart changes given")
+    _validate_cart_changes(changes)
 
-@app.get("/cart/", response_model=list[ShoppingCartItemResponse], dependencies=[Depends(get_current_user)])
-async def get_cart(current_user: dict = Depends(get_current_user)):
-    user_uuid = current_user["sub"]
+    cart = await run_blocking(_apply_cart_changes, current_user["sub"], changes)
+    return cart
 
+def _fetch_cart(user_uuid):
+    # Before the checkout: a catalog reload takes a pool connection of its
+    # own, and must never wait on a pool this thread is holding a slot of.
+    token, _ = catalog_version.current()
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    try:
+        version = repository.cart_version(conn, user_uuid)
+        return cart_cache.get_or_load((user_uuid, version, token), lambda: _read_cart(conn, user_uuid))
+    finally:
+        conn.close()
 
-    query = """
-    SELECT 
-        sci.productId AS product_id, 
-        p.name, 
-        sci.quantity, 
-        p.price
-    FROM 
-        ShoppingCartItem sci
-    JOIN 
-        Product p ON sci.productId = p.id
-    WHERE 
-        sci.cartId = (SELECT cartId FROM ShoppingCart WHERE owner = %s)
-    """
+@app.get("/cart/", response_model=ShoppingCartResponse, dependencies=[Depends(get_current_user)])
+async def get_cart(current_user: dict = Depends(get_current_user)):
+    user_uuid = current_user["sub"]
+    cart = await run_blocking(_fetch_cart, user_uuid)
 
-    cursor.execute(query, (user_uuid,))
-    cart_items = cursor.fetchall()
+    if not cart or not cart["items"]:
+        raise HTTPException(status_code=404, detail="Cart is empty")
 
-    cursor.close()
-    conn.close()
+    return cart
 
-    if not cart_items:
-        raise HTTPException(status_code=404, detail="Cart is empty")
+def _customer_details(customer):
+    return {
+        "first_name": customer['userName'].split()[0],
+        "last_name": " ".join(customer['userName'].split()[1:]),
+        "email": customer['email'],
+        "phone": customer['phone']
+    }
 
-    return cart_items
+def _gross_amount(total_amount):
+    # Midtrans takes a plain JSON number; IDR amounts are whole rupiah
+    return int(total_amount) if total_amount == total_amount.to_integral_value() else float(total_amount)
 
-@app.post("/cart/checkout", dependencies=[Depends(get_current_user)], response_class=HTMLResponse)
-async def checkout_cart(cartId: int = Form(...), current_user: dict = Depends(get_current_user)):
-    user_uuid = current_user["sub"]
+def _place_order(cartId, user_uuid):
+    # Taken before the checkout connection: a block refill needs its own one.
+    order_number = order_numbers.next_number()
 
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    reservation = None
 
     try:
         # Get cart items
-        cursor.execute("""
-        SELECT 
-            sci.productId AS product_id, 
-            p.name, 
-            p.price, 
-            sci.quantity
-        FROM 
-            ShoppingCartItem sci
-        JOIN 
-            Product p ON sci.productId = p.id
-        WHERE 
-            sci.cartId = %s AND sci.cartId = (SELECT cartId FROM ShoppingCart WHERE owner = %s)
-        """, (cartId, user_uuid))
-        cart_items = cursor.fetchall()
+        cart_items = repository.checkout_lines(conn, cartId, user_uuid)
 
         if not cart_items:
-            cursor.close()
-            conn.close()
             raise HTTPException(status_code=404, detail="Cart is empty")
 
-        # Convert Decimal to float
+        # Prices stay Decimal all the way to the order rows
         for item in cart_items:
-            item['price'] = float(item['price'])
+            item['price'] = money(item['price'])
+            item['line_total'] = money(item['price'] * item['quantity'])
 
-        # Calculate total amount
-        total_amount = sum(item['price'] * item['quantity'] for item in cart_items)
+        total_amount = money(sum(item['line_total'] for item in cart_items))
 
-        # Generate a unique 5-digit order number
-        while True:
-            order_number = random.randint(10000, 99999)
-            cursor.execute("SELECT 1 FROM CustomerOrder WHERE orderNumber = %s", (order_number,))
-            if not cursor.fetchone():
-                break
+        # Take the stock before writing the order; never oversells
+        reservation = inventory.reserve(cursor, [(item['product_id'], item['quantity']) for item in cart_items])
 
         # Create order
         cursor.execute(
@@ -478,37 +1215,65 @@ async def checkout_cart(cartId: int = Form(...), current_user: dict = Depends(ge
         )
         order_id = cursor.lastrowid
 
-        # Add items to orderItems
-        for item in cart_items:
-            cursor.execute(
-                "INSERT INTO orderItems (orderId, productId, quantity, price) VALUES (%s, %s, %s, %s)",
-                (order_id, item['product_id'], item['quantity'], item['price'])
-            )
+        # Add items to orderItems, sent as one multi-row INSERT
+        cursor.executemany(
+            "INSERT INTO orderItems (orderId, productId, quantity, price) VALUES (%s, %s, %s, %s)",
+            [(order_id, item['product_id'], item['quantity'], item['price']) for item in cart_items]
+        )
 
         # Clear the cart
         cursor.execute("DELETE FROM ShoppingCartItem WHERE cartId = %s", (cartId,))
-        conn.commit()
+        cursor.execute("UPDATE ShoppingCart SET version = version + 1 WHERE cartId = %s", (cartId,))
 
         # Get customer details
         cursor.execute("SELECT userName, email, phone FROM Customer WHERE uuid = %s", (user_uuid,))
         customer = cursor.fetchone()
 
+        # Keep the per-customer totals current instead of summing on read
+        cursor.execute(
+            "INSERT INTO CustomerOrderStats (customer, order_count, lifetime_spend, last_order_at) "
+            "VALUES (%s, 1, %s, NOW()) "
+            "ON DUPLICATE KEY UPDATE order_count = order_count + 1, "
+            "lifetime_spend = lifetime_spend + VALUES(lifetime_spend), last_order_at = VALUES(last_order_at)",
+            (user_uuid, total_amount)
+        )
+
+        # Post-checkout work commits with the order and runs in the background
+        cursor.executemany(INSERT_OUTBOX, outbox_rows(order_id, [
+            ("payment_link", {
+                "order_number": order_number,
+                "gross_amount": _gross_amount(total_amount),
+                "customer_details": _customer_details(customer)
+            }),
+            ("order_log", {"order_status": "Pending"}),
+            ("shipment", {"shipment_status": "Pending"}),
+        ]))
+        conn.commit()
+        inventory.confirm(reservation)
+
+    except OutOfStock as exc:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail=str(exc))
+    except InvalidQuantity as exc:
+        conn.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
     except mysql.connector.Error as err:
         conn.rollback()
+        inventory.cancel(reservation)
         raise HTTPException(status_code=500, detail=f"Database error: {err}")
     finally:
         cursor.close()
         conn.close()
 
-    customer_details = {
-        "first_name": customer['userName'].split()[0],
-        "last_name": " ".join(customer['userName'].split()[1:]),
-        "email": customer['email'],
-        "phone": customer['phone']
-    }
+    return order_number, total_amount, cart_items, customer
 
-    # Get payment URL from Midtrans
-    payment_url = get_payment_url(order_number, total_amount, customer_details)
+@app.post("/cart/checkout", dependencies=[Depends(get_current_user)], response_class=HTMLResponse)
+async def checkout_cart(cartId: int = Form(...), current_user: dict = Depends(get_current_user)):
+    order_number, total_amount, cart_items, customer = await run_blocking(_place_order, cartId, current_user["sub"])
+    outbox.notify()
+
+    # The Midtrans link is created by the outbox dispatcher; clients poll for it
+    payment_status_url = f"/orders/{order_number}/payment"
 
     # Generate HTML receipt
     receipt_html = f"""
@@ -549,14 +1314,14 @@ async def checkout_cart(cartId: int = Form(...), current_user: dict = Depends(ge
                         </tr>
                     </thead>
                     <tbody>
-                        {''.join(f"<tr><td>{item['name']}</td><td>{item['quantity']}</td><td>{item['price']}</td><td>{item['price'] * item['quantity']}</td></tr>" for item in cart_items)}
+                        {''.join(f"<tr><td>{item['name']}</td><td>{item['quantity']}</td><td>{item['price']}</td><td>{item['line_total']}</td></tr>" for item in cart_items)}
                     </tbody>
                 </table>
                 <h2>Total Amount: {total_amount}</h2>
             </div>
             <div class="receipt-footer">
                 <p>Thank you for your purchase!</p>
-                <p><a href="{payment_url}" target="_blank">Proceed to Payment</a></p>
+                <p>Your payment link is being prepared, fetch it from <code>{payment_status_url}</code></p>
             </div>
         </div>
     </body>
@@ -565,20 +1330,219 @@ async def checkout_cart(cartId: int = Form(...), current_user: dict = Depends(ge
 
     return HTMLResponse(content=receipt_html)
 
-# Shipment endpoints
-@app.post("/shipments/", dependencies=[Depends(get_current_user)])
-def create_shipment(shipment: Shipment, current_user: dict = Depends(get_current_user)):
+def _encode_order_cursor(created, order_id):
+    return base64.urlsafe_b64encode(f"{created.isoformat()}|{order_id}".encode()).decode()
+
+def _decode_order_cursor(cursor_token):
+    try:
+        created, order_id = base64.urlsafe_b64decode(cursor_token.encode()).decode().split("|")
+        return datetime.fromisoformat(created), int(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _fetch_customer_orders(user_uuid, statuses, before, limit, expand_items):
+    filters = ["customer = %s"]
+    params = [user_uuid]
+    if statuses:
+        filters.append(f"status IN ({', '.join(['%s'] * len(statuses))})")
+        params.extend(statuses)
+    if before:
+        # Expanded form of (created, id) < (%s, %s) so the range can use the
+        # (customer, created, id) index.
+        filters.append("(created < %s OR (created = %s AND id < %s))")
+        params.extend([before[0], before[0], before[1]])
+    page = (
+        "SELECT id, orderNumber, total_amount, status, created FROM CustomerOrder "
+        f"WHERE {' AND '.join(filters)} ORDER BY created DESC, id DESC LIMIT %s"
+    )
+    params.append(limit)
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO Shipment (id, order_id, shipment_status) VALUES (%s, %s, %s)",
-        (shipment.id, shipment.order_id, shipment.shipment_status)
+    try:
+        if expand_items:
+            # One query for the page and its items instead of one per order
+            cursor.execute(
+                "SELECT o.id, o.orderNumber, o.total_amount, o.status, o.created, "
+                "i.productId, i.quantity, i.price "
+                f"FROM ({page}) o LEFT JOIN orderItems i ON i.orderId = o.id "
+                "ORDER BY o.created DESC, o.id DESC",
+                tuple(params)
+            )
+        else:
+            cursor.execute(page, tuple(params))
+        rows = cursor.fetchall()
+        cursor.execute(
+            "SELECT order_count, lifetime_spend, last_order_at FROM CustomerOrderStats WHERE customer = %s",
+            (user_uuid,)
+        )
+        totals = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    return rows, totals
+
+@app.get("/customers/{user_uuid}/orders", dependencies=[Depends(get_current_user)])
+async def get_customer_orders(
+    user_uuid: str,
+    status: list[str] = Query(None),
+    cursor: str = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    expand: str = Query(None, pattern="^items$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["sub"] != user_uuid:
+        raise HTTPException(status_code=403, detail="You do not have permission to view these orders")
+
+    before = _decode_order_cursor(cursor) if cursor else None
+    rows, totals = await run_blocking(_fetch_customer_orders, user_uuid, status, before, limit, expand == "items")
+
+    orders = {}
+    for row in rows:
+        order = orders.get(row[0])
+        if order is None:
+            order = orders[row[0]] = {
+                "id": row[0],
+                "orderNumber": row[1],
+                "total_amount": row[2],
+                "status": row[3],
+                "created": row[4],
+            }
+            if expand == "items":
+                order["items"] = []
+        if expand == "items" and row[5] is not None:
+            order["items"].append({"product_id": row[5], "quantity": row[6], "price": row[7]})
+
+    items = list(orders.values())
+    return {
+        "items": items,
+        "next_cursor": _encode_order_cursor(items[-1]["created"], items[-1]["id"]) if len(items) == limit else None,
+        "totals": {
+            "order_count": totals[0] if totals else 0,
+            "lifetime_spend": totals[1] if totals else Decimal("0.00"),
+            "last_order_at": totals[2] if totals else None,
+        }
+    }
+
+async def _create_payment_link(event):
+    payload = event["payload"]
+    payment_url = await payment_client.get_payment_url(
+        payload["order_number"], payload["gross_amount"], payload["customer_details"]
     )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    return [("UPDATE CustomerOrder SET payment_url = %s WHERE id = %s", (payment_url, event["order_id"]))]
+
+async def _write_initial_order_log(event):
+    return [(
+        "INSERT INTO OrderLog (order_id, order_status) VALUES (%s, %s)",
+        (event["order_id"], event["payload"]["order_status"])
+    )]
+
+async def _queue_shipment(event):
+    return [(
+        "INSERT INTO Shipment (order_id, shipment_status) VALUES (%s, %s)",
+        (event["order_id"], event["payload"]["shipment_status"])
+    )]
+
+outbox = create_dispatcher(get_db_connection, run_blocking, {
+    "payment_link": _create_payment_link,
+    "order_log": _write_initial_order_log,
+    "shipment": _queue_shipment,
+})
+
+@app.get("/orders/{order_number}/payment", dependencies=[Depends(get_current_user)])
+def get_order_payment(order_number: int, current_user: dict = Depends(get_current_user)):
+    conn = get_db_connection()
+    try:
+        order = repository.order_payment(conn, order_number, current_user["sub"])
+    finally:
+        conn.close()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order[0]:
+        return {"order_number": order_number, "status": "ready", "payment_url": order[0]}
+    if order[1] == "failed":
+        return {"order_number": order_number, "status": "failed", "payment_url": None, "error": order[2]}
+    return {"order_number": order_number, "status": "pending", "payment_url": None}
+
+# Status ingestion shared by the single-row and batch endpoints
+SHIPMENT_INSERT = BulkSpec(Shipment, "Shipment", ("id", "order_id", "shipment_status"))
+ORDERLOG_INSERT = BulkSpec(
+    OrderLog, "OrderLog", ("id", "order_id", "order_status"),
+    topic=lambda record: ("order", record.order_id)
+)
+SHIPMENTLOG_INSERT = BulkSpec(
+    ShipmentLog, "ShipmentLog", ("id", "shipment_id", "shipment_status"),
+    topic=lambda record: ("shipment", record.shipment_id)
+)
+
+def _insert_one(spec, record):
+    results = insert_chunk(get_db_connection, spec, [(0, record)])
+    if not results[0]["ok"]:
+        error = results[0]["error"]
+        raise HTTPException(status_code=400 if error == ROW_CONFLICT else 500, detail=error)
+    log_notifier.publish(topics(spec, [(0, record)], results))
+
+async def _ingest_items(spec, items, start_index):
+    records, errors = validate(spec, items, start_index)
+    results = await run_blocking(insert_chunk, get_db_connection, spec, records)
+    log_notifier.publish(topics(spec, records, results))
+    return errors + results
+
+def _check_batch_size(count, results):
+    # NDJSON chunks already inserted stay in; the 413 says which they were
+    if count > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail={
+            "message": f"More than {BULK_MAX_ITEMS} rows in one batch", **summarize(results),
+        })
+
+async def _bulk_ingest(spec, request: Request):
+    # Accepts a JSON array, or NDJSON (one object per line) which is inserted
+    # chunk by chunk while the body is still arriving. Either way a batch
+    # holds at most BULK_MAX_ITEMS rows.
+    results = []
+    if "ndjson" in request.headers.get("content-type", ""):
+        buffer, pending, index = b"", [], 0
+        async for chunk in request.stream():
+            lines, buffer = iter_ndjson_lines(buffer, chunk)
+            _check_batch_size(index + len(pending) + len(lines), results)
+            pending.extend(parse_line(line) for line in lines)
+            if len(pending) >= BULK_CHUNK_SIZE:
+                results += await _ingest_items(spec, pending, index)
+                index += len(pending)
+                pending = []
+        if buffer.strip():
+            _check_batch_size(index + len(pending) + 1, results)
+            pending.append(parse_line(buffer))
+        if pending:
+            results += await _ingest_items(spec, pending, index)
+    else:
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > BULK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Body exceeds {BULK_MAX_BYTES} bytes, send NDJSON to stream larger batches")
+        try:
+            items = json.loads(await read_limited(request.stream(), BULK_MAX_BYTES))
+        except BatchTooLarge as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if len(items) > BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"More than {BULK_MAX_ITEMS} rows in one batch")
+        for start in range(0, len(items), BULK_CHUNK_SIZE):
+            results += await _ingest_items(spec, items[start:start + BULK_CHUNK_SIZE], start)
+    return summarize(results)
+
+# Shipment endpoints
+@app.post("/shipments/", dependencies=[Depends(get_current_user)])
+def create_shipment(shipment: Shipment, current_user: dict = Depends(get_current_user)):
+    _insert_one(SHIPMENT_INSERT, shipment)
     return {"message": "Shipment created"}
 
+@app.post("/shipments/batch", dependencies=[Depends(get_current_user)])
+async def create_shipments(request: Request):
+    return await _bulk_ingest(SHIPMENT_INSERT, request)
+
 
 
 @app.get("/shipments/{shipment_id}", dependencies=[Depends(get_current_user)])
@@ -594,20 +1558,108 @@ def get_shipment(shipment_id: int, current_user: dict = Depends(get_current_user
         return {"id": shipment[0], "order_id": shipment[1], "shipment_status": shipment[2]}
     raise HTTPException(status_code=404, detail="Shipment not found")
 
-# OrderLog endpoints
-@app.post("/orderlogs/", dependencies=[Depends(get_current_user)])
-def create_orderlog(order_log: OrderLog, current_user: dict = Depends(get_current_user)):
+def _fetch_shipment_timeline(shipment_id, after_id, limit):
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM Shipment WHERE id = %s", (shipment_id,))
+    exists = cursor.fetchone() is not None
     cursor.execute(
-        "INSERT INTO OrderLog (id, order_id, order_status) VALUES (%s, %s, %s)",
-        (order_log.id, order_log.order_id, order_log.order_status)
+        "SELECT id, shipment_id, shipment_status FROM ShipmentLog "
+        "WHERE shipment_id = %s AND id > %s ORDER BY id LIMIT %s",
+        (shipment_id, after_id, limit)
     )
-    conn.commit()
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return exists, rows
+
+@app.get("/shipments/{shipment_id}/timeline", dependencies=[Depends(get_current_user)])
+async def get_shipment_timeline(
+    shipment_id: int,
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200)
+):
+    exists, rows = await run_blocking(_fetch_shipment_timeline, shipment_id, after_id, limit)
+    if not exists:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    items = [{"id": row[0], "shipment_id": row[1], "shipment_status": row[2]} for row in rows]
+    return {"items": items, "next_after_id": items[-1]["id"] if len(items) == limit else None}
+
+def _fetch_shipment_order(shipment_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT order_id FROM Shipment WHERE id = %s", (shipment_id,))
+    shipment = cursor.fetchone()
     cursor.close()
     conn.close()
+    return shipment
+
+def _fetch_new_logs(shipment_id, order_id, after_shipmentlog, after_orderlog, limit=100):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "(SELECT 'shipmentlog', id, shipment_status FROM ShipmentLog "
+        " WHERE shipment_id = %s AND id > %s ORDER BY id LIMIT %s) "
+        "UNION ALL "
+        "(SELECT 'orderlog', id, order_status FROM OrderLog "
+        " WHERE order_id = %s AND id > %s ORDER BY id LIMIT %s)",
+        (shipment_id, after_shipmentlog, limit, order_id, after_orderlog, limit)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+async def _shipment_event_stream(request: Request, shipment_id, order_id, after_shipmentlog, after_orderlog):
+    keys = [("shipment", shipment_id), ("order", order_id)]
+    while not await request.is_disconnected():
+        rows = await run_blocking(_fetch_new_logs, shipment_id, order_id, after_shipmentlog, after_orderlog)
+        for kind, row_id, status in rows:
+            if kind == "shipmentlog":
+                after_shipmentlog = max(after_shipmentlog, row_id)
+                data = {"id": row_id, "shipment_id": shipment_id, "shipment_status": status}
+            else:
+                after_orderlog = max(after_orderlog, row_id)
+                data = {"id": row_id, "order_id": order_id, "order_status": status}
+            yield f"id: {after_shipmentlog}:{after_orderlog}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+        if rows:
+            continue
+        if not await log_notifier.wait(keys, STREAM_RECHECK_SECONDS):
+            yield ": keep-alive\n\n"
+
+@app.get("/shipments/{shipment_id}/events", dependencies=[Depends(get_current_user)])
+async def stream_shipment_events(
+    shipment_id: int,
+    request: Request,
+    last_event_id: str = Header(None),
+    after_shipmentlog_id: int = Query(0, ge=0),
+    after_orderlog_id: int = Query(0, ge=0)
+):
+    # Server-Sent Events; a reconnecting EventSource resumes from Last-Event-ID.
+    shipment = await run_blocking(_fetch_shipment_order, shipment_id)
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    if last_event_id:
+        try:
+            after_shipmentlog_id, after_orderlog_id = (int(part) for part in last_event_id.split(":"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(
+        _shipment_event_stream(request, shipment_id, shipment[0], after_shipmentlog_id, after_orderlog_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# OrderLog endpoints
+@app.post("/orderlogs/", dependencies=[Depends(get_current_user)])
+def create_orderlog(order_log: OrderLog, current_user: dict = Depends(get_current_user)):
+    _insert_one(ORDERLOG_INSERT, order_log)
     return {"message": "OrderLog created"}
 
+@app.post("/orderlogs/batch", dependencies=[Depends(get_current_user)])
+async def create_orderlogs(request: Request):
+    return await _bulk_ingest(ORDERLOG_INSERT, request)
+
 @app.get("/orderlogs/{orderlog_id}", dependencies=[Depends(get_current_user)])
 def get_orderlog(orderlog_id: int, current_user: dict = Depends(get_current_user)):
     conn = get_db_connection()
@@ -624,17 +1676,13 @@ def get_orderlog(orderlog_id: int, current_user: dict = Depends(get_current_user
 # ShipmentLog endpoints
 @app.post("/shipmentlogs/", dependencies=[Depends(get_current_user)])
 def create_shipmentlog(shipment_log: ShipmentLog, current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO ShipmentLog (id, shipment_id, shipment_status) VALUES (%s, %s, %s)",
-        (shipment_log.id, shipment_log.shipment_id, shipment_log.shipment_status)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    _insert_one(SHIPMENTLOG_INSERT, shipment_log)
     return {"message": "ShipmentLog created"}
 
+@app.post("/shipmentlogs/batch", dependencies=[Depends(get_current_user)])
+async def create_shipmentlogs(request: Request):
+    return await _bulk_ingest(SHIPMENTLOG_INSERT, request)
+
 @app.get("/shipmentlogs/{shipmentlog_id}", dependencies=[Depends(get_current_user)])
 def get_shipmentlog(shipmentlog_id: int, current_user: dict = Depends(get_current_user)):
     conn = get_db_connection()
@@ -652,5 +1700,103 @@ def get_shipmentlog(shipmentlog_id: int, current_user: dict = Depends(get_curren
 @app.get('/api')
 def api():
     return {"message": "Welcome to the API"}
+
+_POOL_EVENTS = ("connections_opened", "connections_recycled", "connections_discarded", "checkouts", "checkout_timeouts")
+_CACHE_EVENTS = ("hits", "misses", "evictions", "expirations", "coalesced", "invalidations")
+_CACHES = {"product": lambda: product_cache, "cart": lambda: cart_cache, "catalog_response": lambda: response_cache}
+
+metrics_registry.collector(
+    "db_pool_connections", "gauge", "Pooled connections by state.", ("state",),
+    lambda: [((state,), db_pool.stats()[state]) for state in ("open", "in_use", "idle")],
+)
+metrics_registry.collector(
+    "db_pool_events_total", "counter", "Connections opened by get_db_connection, checkouts and timeouts.", ("event",),
+    lambda: [((event,), db_pool.stats()[event]) for event in _POOL_EVENTS],
+)
+metrics_registry.collector(
+    "db_pool_wait_seconds_total", "counter", "Time spent waiting for a free connection.", (),
+    lambda: [((), db_pool.stats()["wait_seconds_total"])],
+)
+metrics_registry.collector(
+    "cache_events_total", "counter", "In-memory cache activity.", ("cache", "event"),
+    lambda: [((name, event), stats[event]) for name, cache in _CACHES.items() for stats in (cache().stats(),) for event in _CACHE_EVENTS],
+)
+metrics_registry.collector(
+    "app_startup_seconds", "gauge", "Time this worker took to import, warm up and become ready.", ("phase",),
+    lambda: [((phase,), startup[f"{phase}_seconds"]) for phase in ("import", "warm_up", "ready") if startup[f"{phase}_seconds"] is not None],
+)
+
+@app.get('/metrics', dependencies=[Depends(require_stats_token)])
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get('/health/live')
+def health_live():
+    return {"status": "ok"}
+
+@app.get('/health/ready')
+async def health_ready():
+    # 503 until the worker finished warming up, and whenever the database
+    # cannot be reached, so the load balancer routes around it.
+    if not startup["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", "pid": startup["pid"]})
+    try:
+        await asyncio.wait_for(asyncio.to_thread(_ping_db), READY_CHECK_TIMEOUT)
+    except Exception as exc:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "pid": startup["pid"], "database": str(exc) or type(exc).__name__})
+    return {"status": "ready", "pid": startup["pid"], "database": "ok"}
+
+@app.get('/stats/startup', dependencies=[Depends(require_stats_token)])
+def startup_stats():
+    return startup
+
+@app.get('/stats/admission', dependencies=[Depends(require_stats_token)])
+def admission_stats():
+    return admission.stats()
+
+@app.get('/stats/db-pool', dependencies=[Depends(require_stats_token)])
+def db_pool_stats():
+    return db_pool.stats()
+
+@app.get('/stats/product-cache', dependencies=[Depends(require_stats_token)])
+def product_cache_stats():
+    return product_cache.stats()
+
+@app.get('/stats/catalog', dependencies=[Depends(require_stats_token)])
+def catalog_stats():
+    return {
+        "version": catalog_version.stats(),
+        "responses": response_cache.stats(),
+        "encodings": list(supported_encodings()),
+    }
+
+@app.get('/stats/cart-cache', dependencies=[Depends(require_stats_token)])
+def cart_cache_stats():
+    return cart_cache.stats()
+
+@app.get('/stats/revocations', dependencies=[Depends(require_stats_token)])
+def revocation_stats():
+    return revocation_list.stats()
+
+@app.get('/stats/tokens', dependencies=[Depends(require_stats_token)])
+def token_stats():
+    stats = token_pruner.stats()
+    stats["interval"] = TOKEN_PRUNE_INTERVAL
+    stats["store_login_tokens"] = STORE_LOGIN_TOKENS
+    return stats
+
+@app.get('/stats/inventory', dependencies=[Depends(require_stats_token)])
+def inventory_stats():
+    return inventory.stats()
+
+@app.get('/stats/payments', dependencies=[Depends(require_stats_token)])
+def payment_stats():
+    return {**payment_client.stats(), "outbox": outbox.stats()}
+
+@app.get('/stats/passwords', dependencies=[Depends(require_stats_token)])
+def password_hashing_stats():
+    return password_stats()
+
+startup["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
 if __name__ == "__main__":
     import uvicorn
\ No newline at end of file
@@ -0,0 +1,37 @@
+# Production entry point: python serve.py
+# Runs WEB_CONCURRENCY uvicorn worker processes under uvicorn's supervisor,
+# which restarts a worker that dies. Signals sent to the supervisor:
+#   SIGHUP   restart the workers one at a time (reload code and config)
+#   SIGTTIN  add a worker, SIGTTOU remove one
+#   SIGTERM  stop taking connections and let workers finish in-flight requests
+# Every worker has its own DB pool, so the database sees up to
+# WEB_CONCURRENCY * (DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW) connections.
+import os
+import uvicorn
+from dotenv import load_dotenv
+from internal.config import env_bool
+
+
+def main():
+    load_dotenv()
+    max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+    # Exported so each worker can size its per-process pools by it
+    workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "80")),
+        workers=workers,
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        timeout_keep_alive=int(os.getenv("KEEPALIVE_TIMEOUT", "5")),
+        # Recycling a worker after MAX_REQUESTS bounds slow leaks, 0 never does
+        limit_max_requests=max_requests or None,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        access_log=env_bool("ACCESS_LOG", True),
+    )
+
+
+if __name__ == "__main__":
+    main()